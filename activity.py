@@ -0,0 +1,137 @@
+import asyncio
+import math
+import time
+
+ACTIVE_WINDOW = 1.0
+MIN_INTERVAL = 0.1
+MAX_INTERVAL = 30.0
+BACKOFF = 2.0
+# in-flight requests older than this (streams, long polls) stop counting
+REQUEST_WINDOW = 10.0
+BINDING = '__ucActivity'
+# activity that can change what the document looks like outside the
+# viewport too, as opposed to scrolling, animation frames and network
+DOCUMENT_CHANGES = ('mutation', 'navigation', 'lifecycle', 'input')
+
+# Reports DOM mutations, animation frames, media playback and scrolling
+# through the CDP binding, at most once per 100ms.
+PAGE_SCRIPT = '''(() => {
+    if (window.__ucActivityInstalled) return;
+    window.__ucActivityInstalled = true;
+    let pending = false;
+    function report(kind) {
+        if (pending) return;
+        pending = true;
+        setTimeout(() => {
+            pending = false;
+            try { window.%(binding)s(kind); } catch (e) {}
+        }, 100);
+    }
+    new MutationObserver(() => report('mutation')).observe(document, {
+        subtree: true, childList: true, attributes: true, characterData: true
+    });
+    const raf = window.requestAnimationFrame;
+    window.requestAnimationFrame = function (callback) {
+        report('raf');
+        return raf.call(window, callback);
+    };
+    document.addEventListener('timeupdate', () => report('media'), true);
+    window.addEventListener('scroll', () => report('scroll'), true);
+})()''' % {'binding': BINDING}
+
+
+class ActivityTracker:
+    """Follows CDP signals of page activity so captures can run fast while
+    the page changes and back off exponentially while it sits still."""
+
+    def __init__(self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+                 backoff=BACKOFF, active_window=ACTIVE_WINDOW):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.active_window = active_window
+        self.last_activity = time.monotonic()
+        self.requests = {}
+        self.animations = {}
+        self.counts = {}
+        # bumped whenever the document may have changed
+        self.version = 0
+        self._wakeup = asyncio.Event()
+
+    async def attach(self, cdp):
+        cdp.on('Runtime.bindingCalled', self._on_binding)
+        cdp.on('Network.requestWillBeSent', self._on_request)
+        cdp.on('Network.loadingFinished', self._on_request_done)
+        cdp.on('Network.loadingFailed', self._on_request_done)
+        cdp.on('Page.lifecycleEvent', lambda event: self.poke('lifecycle'))
+        cdp.on('Page.frameNavigated', lambda event: self.poke('navigation'))
+        cdp.on('Animation.animationStarted', self._on_animation)
+        cdp.on('Animation.animationCanceled',
+               lambda event: self.animations.pop(event['id'], None))
+        await asyncio.gather(
+            cdp.send('Runtime.enable'),
+            cdp.send('Network.enable'),
+            cdp.send('Page.enable'),
+            cdp.send('Animation.enable'))
+        await cdp.send('Page.setLifecycleEventsEnabled', {'enabled': True})
+        await cdp.send('Runtime.addBinding', {'name': BINDING})
+        await cdp.send('Page.addScriptToEvaluateOnNewDocument',
+                       {'source': PAGE_SCRIPT})
+        await cdp.send('Runtime.evaluate', {'expression': PAGE_SCRIPT})
+
+    def poke(self, reason='input'):
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        if reason in DOCUMENT_CHANGES:
+            self.version += 1
+        self.last_activity = time.monotonic()
+        self._wakeup.set()
+
+    def _on_binding(self, event):
+        if event.get('name') == BINDING:
+            self.poke(event.get('payload') or 'page')
+
+    def _on_request(self, event):
+        self.requests[event['requestId']] = time.monotonic()
+        self.poke('network')
+
+    def _on_request_done(self, event):
+        self.requests.pop(event['requestId'], None)
+        self.poke('network')
+
+    def _on_animation(self, event):
+        source = event['animation'].get('source') or {}
+        iterations = source.get('iterations')
+        duration = source.get('duration', 0) / 1000
+        if iterations is None or math.isinf(iterations):
+            until = math.inf
+        else:
+            until = time.monotonic() + duration * iterations
+        self.animations[event['animation']['id']] = until
+        self.poke('animation')
+
+    def active(self):
+        now = time.monotonic()
+        if any(until > now for until in self.animations.values()):
+            return True
+        if any(now - started < REQUEST_WINDOW for started in self.requests.values()):
+            return True
+        return now - self.last_activity < self.active_window
+
+    def changed_since(self, moment):
+        return self.active() or self.last_activity >= moment
+
+    def interval(self, idle_captures=0):
+        """Capture interval after ``idle_captures`` unchanged captures in a
+        row: the minimum while active, growing exponentially when idle."""
+        if self.active():
+            return self.min_interval
+        return min(self.max_interval,
+                   self.min_interval * self.backoff ** (idle_captures + 1))
+
+    async def wait(self, timeout):
+        """Sleep for ``timeout`` seconds, waking early on new activity."""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,73 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+PAGE = os.path.join(BASE_DIR, 'browser.html')
+# versioned URLs never change content, so clients may keep them for a year
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+
+
+class Asset:
+    """A file held in memory with its version and precompressed bodies."""
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.version = hashlib.blake2b(body, digest_size=8).hexdigest()
+        self.encoded = {}
+        if mimetype.startswith(COMPRESSIBLE):
+            self.encoded['gzip'] = gzip.compress(body, 9, mtime=0)
+            if brotli is not None:
+                self.encoded['br'] = brotli.compress(body)
+
+    def response(self, request, cache_control=REVALIDATE):
+        etag = f'"{self.version}"'
+        headers = {'ETag': etag, 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers=headers)
+        body = self.body
+        accepted = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in self.encoded and accepted[encoding]:
+                body = self.encoded[encoding]
+                headers['Content-Encoding'] = encoding
+                break
+        return Response(body, content_type=self.mimetype, headers=headers)
+
+
+def load_static(directory=STATIC_DIR):
+    assets = {}
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name), 'rb') as file:
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            if mimetype.startswith('text/') or mimetype == 'application/javascript':
+                mimetype += '; charset=utf-8'
+            assets[name] = Asset(file.read(), mimetype)
+    return assets
+
+
+def load_page(assets, path=PAGE):
+    """The UI page with every ``/static/<name>`` reference pinned to the
+    asset's current version, so the assets themselves can be immutable."""
+    with open(path) as file:
+        html = file.read()
+
+    def pin(match):
+        asset = assets.get(match.group(1))
+        return match.group(0) if asset is None else f'{match.group(0)}?v={asset.version}'
+
+    html = re.sub(r'/static/([\w.-]+)', pin, html)
+    return Asset(html.encode(), 'text/html; charset=utf-8')
@@ -0,0 +1,412 @@
+"""Benchmark ``browser_app`` against a local fixture site.
+
+Starts a fixture server for the pages in ``bench/fixtures`` and a
+``browser_app`` process on free local ports, then drives the HTTP API with
+simulated clients and writes the results as JSON:
+
+    python bench/run.py --clients 4 --duration 20 --output results.json
+
+Everything stays on localhost, so the run works offline as long as a
+Chromium is installed; set CHROME_PATH if it is not on PATH.
+"""
+import argparse
+import http.client
+import http.server
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import process_tree, rss_bytes
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PAGES = ('static', 'animated', 'heavy', 'scroll')
+# pages whose pixels change when scrolled, for input-to-frame latency
+INPUT_PAGES = ('scroll',)
+SLOW_DELAY = 0.5
+STARTUP_TIMEOUT = 120
+RSS_INTERVAL = 0.2
+SLOW_BODIES = {
+    '.css': ('text/css', 'body { background: #fdfdf8; }\n'),
+    '.js': ('application/javascript', 'window.heavyLoaded = (window.heavyLoaded || 0) + 1;\n'),
+    '.svg': ('image/svg+xml', '<svg xmlns="http://www.w3.org/2000/svg" width="200" '
+                              'height="200"><circle cx="100" cy="100" r="90" fill="#4af"/></svg>'),
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 2)
+
+    return {'count': len(ordered), 'mean': round(sum(ordered) / len(ordered), 2),
+            'p50': rank(50), 'p95': rank(95), 'p99': rank(99), 'max': round(ordered[-1], 2)}
+
+
+def server_timing(header):
+    stages = {}
+    for part in (header or '').split(','):
+        name, _, duration = part.strip().partition(';dur=')
+        if duration:
+            stages[name] = float(duration)
+    return stages
+
+
+class FixtureHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves the fixture pages; ``/slow/<name>`` answers after a delay so
+    pages have a gap between first paint and load."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=FIXTURES, **kwargs)
+
+    def do_GET(self):
+        if not self.path.startswith('/slow/'):
+            return super().do_GET()
+        time.sleep(SLOW_DELAY)
+        content_type, body = SLOW_BODIES.get(os.path.splitext(self.path)[1], ('text/plain', ''))
+        body = body.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'max-age=3600')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def end_headers(self):
+        if not self.path.startswith('/slow/'):
+            self.send_header('Cache-Control', 'no-cache')
+        super().end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class App:
+    """A ``browser_app`` process with a throwaway profile."""
+
+    def __init__(self, port, env=None):
+        self.port = port
+        self.profile = tempfile.mkdtemp(prefix='uc-bench-')
+        # nothing of a bench run is worth keeping across restarts
+        self.env = dict(os.environ, PORT=str(port), USER_DATA_DIR=self.profile,
+                        SESSION_STORE='', **(env or {}))
+        if 'CHROME_PATH' not in self.env:
+            for name in ('chromium', 'chromium-browser', 'google-chrome'):
+                if shutil.which(name):
+                    self.env['CHROME_PATH'] = shutil.which(name)
+                    break
+        self.process = None
+
+    def start(self, timeout=STARTUP_TIMEOUT):
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'browser_app.py')],
+                                        env=self.env, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        client = Client(self.port)
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'browser_app exited with {self.process.returncode}')
+            try:
+                status, _, body = client.request('GET', '/api/health')
+                if status == 200 and json.loads(body)['ready']:
+                    return
+            except OSError:
+                client.close()
+            time.sleep(0.5)
+        raise RuntimeError('browser_app did not become ready in time')
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        shutil.rmtree(self.profile, ignore_errors=True)
+
+
+class RssSampler(threading.Thread):
+    """Tracks peak RSS of the app process and of its Chromium children."""
+
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.stopped = threading.Event()
+        self.reset()
+
+    def reset(self):
+        self.python_peak = 0
+        self.chromium_peak = 0
+
+    def run(self):
+        while not self.stopped.wait(RSS_INTERVAL):
+            self.python_peak = max(self.python_peak, rss_bytes(self.pid) // 1024)
+            # the tree starts with the app process itself
+            chromium = sum(rss_bytes(child) for child in process_tree(self.pid)[1:]) // 1024
+            self.chromium_peak = max(self.chromium_peak, chromium)
+
+    def peaks(self):
+        return {'python_peak_mb': round(self.python_peak / 1024, 1),
+                'chromium_peak_mb': round(self.chromium_peak / 1024, 1)}
+
+
+class Client:
+    """One simulated viewer: a kept-alive connection and a session cookie."""
+
+    def __init__(self, port, cookie=None):
+        self.port = port
+        self.cookie = cookie
+        self.connection = None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def request(self, method, path, body=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        try:
+            self.connection.request(method, path, body=json.dumps(body) if body is not None
+                                    else None, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+        cookie = response.getheader('Set-Cookie')
+        if cookie and not self.cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        if response.will_close:
+            self.close()
+        return response.status, response, data
+
+    def navigate(self, url):
+        """Navigate and follow the job; returns the milestone times in ms."""
+        started = time.perf_counter()
+        status, _, body = self.request('POST', '/api/navigate', {'url': url})
+        if status != 202:
+            raise RuntimeError(f'navigate returned {status}: {body[:200]}')
+        job, seq, milestones = json.loads(body)['job'], 0, {}
+        while True:
+            status, _, body = self.request('GET', f'/api/navigate/{job}?after={seq}')
+            data = json.loads(body)
+            seq = data['seq']
+            for event in data['events']:
+                milestones[event['name']] = event['ms']
+            if data['done']:
+                milestones['wall'] = round((time.perf_counter() - started) * 1000)
+                return milestones
+
+    def frame(self, after, format='jpeg', timeout=2):
+        path = f'/api/frame?format={format}&client={id(self)}'
+        if after is not None:
+            path += f'&after={after}&timeout={timeout}'
+        started = time.perf_counter()
+        status, response, body = self.request('GET', path)
+        if status != 200:
+            raise RuntimeError(f'frame returned {status}')
+        return {'ms': (time.perf_counter() - started) * 1000, 'bytes': len(body),
+                'seq': int(response.getheader('X-Frame-Seq', 0)),
+                'stages': server_timing(response.getheader('Server-Timing'))}
+
+    def delta(self, client_id, keyframe=False):
+        path = f'/api/screenshot/delta?client={client_id}' + ('&keyframe=1' if keyframe else '')
+        started = time.perf_counter()
+        status, response, body = self.request('GET', path)
+        if status != 200:
+            raise RuntimeError(f'delta returned {status}')
+        data = json.loads(body)
+        return {'ms': (time.perf_counter() - started) * 1000,
+                'bytes': sum(len(tile['data']) * 3 // 4 for tile in data['tiles']),
+                'seq': data['seq'],
+                'stages': server_timing(response.getheader('Server-Timing'))}
+
+    def wheel(self, dy):
+        status, _, body = self.request('POST', '/api/input', {'events': [
+            {'type': 'wheel', 'x': 640, 'y': 360, 'dx': 0, 'dy': dy}]})
+        if status != 200:
+            raise RuntimeError(f'input returned {status}: {body[:200]}')
+
+
+class PageRun:
+    """Samples collected by all clients for one fixture page."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.navigation = {}
+        self.latency = []
+        self.bytes = []
+        self.stages = {}
+        self.frames = 0
+        self.input = []
+        self.errors = []
+
+    def add_frame(self, sample, new):
+        with self.lock:
+            # a long poll's wait for the page to change is not latency
+            self.latency.append(sample['ms'] - sample['stages'].get('wait', 0))
+            for name, duration in sample['stages'].items():
+                self.stages.setdefault(name, []).append(duration)
+            if new:
+                self.frames += 1
+                self.bytes.append(sample['bytes'])
+
+    def add_navigation(self, milestones):
+        with self.lock:
+            for name, ms in milestones.items():
+                self.navigation.setdefault(name, []).append(ms)
+
+    def summary(self, duration, clients):
+        return {
+            'navigation_ms': {name: percentiles(values)
+                              for name, values in self.navigation.items()},
+            'frame_latency_ms': percentiles(self.latency),
+            'capture_ms': percentiles(self.stages.get('capture', [])),
+            'decode_ms': percentiles(self.stages.get('decode', [])),
+            'encode_ms': percentiles(self.stages.get('encode', [])),
+            'stages_ms': {name: percentiles(values) for name, values in self.stages.items()},
+            'fps_per_client': round(self.frames / duration / clients, 2),
+            'fps_total': round(self.frames / duration, 2),
+            'bytes_per_frame': percentiles(self.bytes),
+            'input_to_frame_ms': percentiles(self.input),
+            'errors': self.errors[:20],
+        }
+
+
+def run_client(client, url, page, results, args, deadline):
+    try:
+        results.add_navigation(client.navigate(url))
+        seq = None
+        client_id = uuid.uuid4().hex
+        keyframe = True
+        while time.monotonic() < deadline:
+            if args.mode == 'delta':
+                sample = client.delta(client_id, keyframe)
+                keyframe = False
+                new = sample['seq'] != seq
+                time.sleep(args.poll_interval)
+            else:
+                sample = client.frame(seq)
+                new = sample['seq'] != seq
+            results.add_frame(sample, new)
+            seq = sample['seq']
+        if page in INPUT_PAGES:
+            for _ in range(args.inputs):
+                before = client.frame(None)['seq']
+                started = time.perf_counter()
+                client.wheel(300)
+                frame = client.frame(before, timeout=5)
+                if frame['seq'] > before:
+                    with results.lock:
+                        results.input.append((time.perf_counter() - started) * 1000)
+    except Exception as e:
+        with results.lock:
+            results.errors.append(f'{type(e).__name__}: {e}')
+
+
+def run_page(page, fixture_port, app_port, args, sampler):
+    url = f'http://127.0.0.1:{fixture_port}/{page}.html'
+    results = PageRun()
+    shared = Client(app_port)
+    shared.request('GET', '/')
+    clients = [shared] + [Client(app_port, shared.cookie if args.shared else None)
+                          for _ in range(args.clients - 1)]
+    for client in clients[1:]:
+        client.request('GET', '/')
+    sampler.reset()
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target=run_client,
+                                args=(client, url, page, results, args, deadline))
+               for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for client in clients:
+        client.close()
+    return dict(results.summary(args.duration, args.clients), rss=sampler.peaks())
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pages', default=','.join(PAGES),
+                        help='comma-separated fixture pages')
+    parser.add_argument('--clients', type=int, default=2, help='concurrent simulated clients')
+    parser.add_argument('--duration', type=float, default=15, help='seconds of frames per page')
+    parser.add_argument('--mode', choices=('frame', 'delta'), default='frame',
+                        help='long-poll binary frames or poll delta tiles')
+    parser.add_argument('--poll-interval', type=float, default=0.2,
+                        help='delay between delta polls')
+    parser.add_argument('--inputs', type=int, default=10,
+                        help='wheel events per client on scrolling pages')
+    parser.add_argument('--shared', action='store_true',
+                        help='all clients view one session instead of one each')
+    parser.add_argument('--output', help='write JSON results here as well as to stdout')
+    args = parser.parse_args(argv)
+
+    fixture_port, app_port = free_port(), free_port()
+    fixtures = http.server.ThreadingHTTPServer(('127.0.0.1', fixture_port), FixtureHandler)
+    threading.Thread(target=fixtures.serve_forever, daemon=True).start()
+    app = App(app_port)
+    started = time.perf_counter()
+    try:
+        app.start()
+        startup = time.perf_counter() - started
+        sampler = RssSampler(app.process.pid)
+        sampler.start()
+        pages = {}
+        for page in args.pages.split(','):
+            print(f'Benchmarking {page}...', file=sys.stderr, flush=True)
+            pages[page] = run_page(page, fixture_port, app_port, args, sampler)
+        sampler.stopped.set()
+    finally:
+        app.stop()
+        fixtures.shutdown()
+
+    report = {
+        'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'commit': git_commit(),
+                 'python': platform.python_version(), 'platform': platform.platform(),
+                 'cpus': os.cpu_count(), 'startup_s': round(startup, 2),
+                 'args': vars(args)},
+        'pages': pages,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
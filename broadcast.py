@@ -0,0 +1,239 @@
+import asyncio
+import sys
+import threading
+import time
+
+from frames import capture_screenshot, frame_etag
+from metrics import CAPTURE_SECONDS, FRAME_REQUESTS
+
+FRAME_INTERVAL = 0.5
+# a viewer that has not polled for this long no longer keeps capture alive
+VIEWER_TIMEOUT = 5.0
+
+
+class FrameBroadcaster:
+    """Shares captures of one session's page between all of its viewers.
+
+    Frames are keyed by ``(format, quality, scale)``. Each key is captured at
+    most once per ``interval`` however many viewers ask, and concurrent
+    requests for a stale key wait on the one capture in flight. Viewers that
+    long-poll with ``next_frame`` always get the latest frame, skipping any
+    they missed, and the background capture loop stops as soon as no viewer
+    has been seen for ``viewer_timeout`` seconds.
+
+    With an ``ActivityTracker`` a frame stays current for as long as the page
+    shows no activity, and the capture loop runs at the tracker's pace:
+    fast while the page changes, backing off exponentially while it is idle,
+    and waking immediately on new activity. Runs on the browser loop, apart
+    from ``latest``, which any thread may call.
+
+    While ``frozen`` (its page hibernated) the broadcaster never captures:
+    every request gets the last frame it has.
+    """
+
+    def __init__(self, page, cdp, viewport, interval=FRAME_INTERVAL,
+                 viewer_timeout=VIEWER_TIMEOUT, on_capture=None, activity=None,
+                 capture_lock=None):
+        self.page = page
+        self.cdp = cdp
+        self.viewport = viewport
+        self.interval = interval
+        self.viewer_timeout = viewer_timeout
+        self.on_capture = on_capture
+        self.activity = activity
+        # held by every capture of the page, shared with its TileCache
+        self.capture_lock = capture_lock or asyncio.Lock()
+        self.slots = {}
+        # new slots are only added on the loop; readers on other threads
+        # copy them under this
+        self._slots_lock = threading.Lock()
+        self.viewers = {}
+        self.captures = 0
+        # shared by every key, so a client switching keys never sees a
+        # sequence number go backwards
+        self._seq = 0
+        self._inflight = {}
+        self._updated = {}
+        self._loop_task = None
+        self.frozen = False
+
+    def rebind(self, page, cdp, activity):
+        """Capture from a new page, keeping the frames taken so far."""
+        self.page = page
+        self.cdp = cdp
+        self.activity = activity
+        self.frozen = False
+        self.invalidate()
+
+    def freeze(self):
+        self.frozen = True
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+
+    def _watch(self, viewer, key):
+        self.viewers[viewer] = (key, time.monotonic())
+
+    def viewer_count(self):
+        now = time.monotonic()
+        return sum(1 for _, seen in list(self.viewers.values())
+                   if now - seen <= self.viewer_timeout)
+
+    def active_keys(self):
+        now = time.monotonic()
+        for viewer, (_, seen) in list(self.viewers.items()):
+            if now - seen > self.viewer_timeout:
+                del self.viewers[viewer]
+        return {key for key, _ in self.viewers.values()}
+
+    def invalidate(self):
+        for frame in self.slots.values():
+            frame['time'] = 0
+
+    def latest(self, key=None):
+        if key is not None:
+            return self.slots.get(key)
+        with self._slots_lock:
+            frames = list(self.slots.values())
+        return max(frames, key=lambda frame: frame['time'], default=None)
+
+    def is_current(self, frame):
+        if self.frozen:
+            return True
+        age = time.monotonic() - frame['time']
+        if age < self.interval:
+            return True
+        # invalidated frames have time 0 and never count as current
+        return (self.activity is not None and frame['time'] > 0
+                and age < self.activity.max_interval
+                and not self.activity.changed_since(frame['captured_at']))
+
+    async def get(self, viewer, key, timings=None):
+        self._watch(viewer, key)
+        frame = self.slots.get(key)
+        if frame is not None and self.is_current(frame):
+            FRAME_REQUESTS.inc(result='hit')
+            return frame
+        FRAME_REQUESTS.inc(result='miss')
+        return await self._capture(key, timings)
+
+    async def next_frame(self, viewer, key, after, timeout):
+        """Wait up to ``timeout`` seconds for a frame newer than ``after``."""
+        self._watch(viewer, key)
+        self._ensure_loop()
+        deadline = time.monotonic() + timeout
+        frame = self.slots.get(key)
+        while frame is None or frame['seq'] <= after:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            updated = self._updated.setdefault(key, asyncio.Event())
+            try:
+                await asyncio.wait_for(updated.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+            frame = self.slots.get(key)
+        if frame is None:
+            FRAME_REQUESTS.inc(result='miss')
+            return await self._capture(key)
+        FRAME_REQUESTS.inc(result='hit')
+        return frame
+
+    async def refresh(self, key):
+        """Capture ``key`` now, however current its frame is."""
+        return await self._capture(key)
+
+    async def _capture(self, key, timings=None):
+        if self.frozen:
+            frame = self.slots.get(key) or self.latest()
+            if frame is None:
+                raise RuntimeError('Session is hibernated and has no frame')
+            return frame
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+        inflight = self._inflight[key] = asyncio.ensure_future(self._do_capture(key))
+        try:
+            frame = await asyncio.shield(inflight)
+        finally:
+            if self._inflight.get(key) is inflight:
+                del self._inflight[key]
+        if timings is not None:
+            timings.stages['capture'] = frame['capture_ms']
+        return frame
+
+    async def _do_capture(self, key):
+        format, quality, scale = key
+        captured_at = time.monotonic()
+        started = time.perf_counter()
+        async with self.capture_lock:
+            data, title = await asyncio.gather(
+                capture_screenshot(self.cdp, format, quality, scale, self.viewport),
+                self.page.title())
+        elapsed = (time.perf_counter() - started) * 1000
+        CAPTURE_SECONDS.observe(elapsed / 1000, format=format)
+        self.captures += 1
+        etag = frame_etag(data)
+        previous = self.slots.get(key)
+        if previous is not None and previous['etag'] == etag:
+            # unchanged pixels keep their sequence number so waiting viewers
+            # are not woken for nothing
+            previous.update(time=time.monotonic(), captured_at=captured_at,
+                            url=self.page.url, title=title, capture_ms=elapsed)
+            return previous
+        self._seq += 1
+        frame = {
+            'seq': self._seq,
+            'time': time.monotonic(),
+            'captured_at': captured_at,
+            'key': key,
+            'data': data,
+            'etag': etag,
+            'url': self.page.url,
+            'title': title,
+            'capture_ms': elapsed,
+            'derived': {},
+        }
+        with self._slots_lock:
+            self.slots[key] = frame
+        if self.on_capture is not None:
+            self.on_capture(frame)
+        updated = self._updated.pop(key, None)
+        if updated is not None:
+            updated.set()
+        return frame
+
+    def _ensure_loop(self):
+        if self.frozen:
+            return
+        if self._loop_task is None or self._loop_task.done():
+            self._loop_task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        idle_captures = 0
+        while True:
+            keys = self.active_keys()
+            if not keys:
+                return
+            changed = False
+            for key in keys:
+                frame = self.slots.get(key)
+                if frame is not None and self.is_current(frame):
+                    continue
+                try:
+                    captured = await self._capture(key)
+                except Exception as e:
+                    print(f"Broadcast capture error: {e}", file=sys.stderr, flush=True)
+                    continue
+                changed = changed or captured is not frame
+            idle_captures = 0 if changed else idle_captures + 1
+            if self.activity is None:
+                await asyncio.sleep(self.interval)
+                continue
+            delay = self.activity.interval(idle_captures)
+            await asyncio.sleep(self.activity.min_interval)
+            await self.activity.wait(delay - self.activity.min_interval)
+
+    def stop(self):
+        self.viewers.clear()
+        if self._loop_task is not None:
+            self._loop_task.cancel()
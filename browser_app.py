@@ -1,334 +1,573 @@
-import nest_asyncio
-nest_asyncio.apply()
-
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from pyppeteer import launch
 import asyncio
 import base64
+import json
+import os
+import signal
 import sys
-import io
-from PIL import Image
+import time
+import uuid
 import threading
+from contextlib import contextmanager
+
+from assets import IMMUTABLE, REVALIDATE, load_page, load_static
+from config import SESSION_COOKIE, SESSION_IDLE_TIMEOUT
+from delta import decode_frame
+from frames import MIMETYPES, Timings, in_pool
+from input_events import dispatch, settle
+from metrics import process_tree, registry, rss_bytes
+from loop_thread import LoopThread
+from resource_cache import BLOCK_CLASSES, DiskCache, parse_policy
+from screencast import Screencaster
+from server import SHORT_POLL_TIMEOUT, long_requests, serve
+from sessions import SessionManager
+from snapshots import SESSION_STORE, SNAPSHOT_MAX_AGE, SnapshotStore
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)
 
 browser = None
-page = None
-loop = None
-lock = threading.Lock()
-last_screenshot = None
-last_screenshot_time = 0
-
-HTML_CONTENT = '''<!DOCTYPE html>
-<html>
-<head>
-    <title>Browser</title>
-    <meta charset="utf-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body { 
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: #000;
-            display: flex;
-            flex-direction: column;
-            height: 100vh;
-            overflow: hidden;
-        }
-        .toolbar {
-            background: #222;
-            padding: 12px 15px;
-            display: flex;
-            gap: 8px;
-            align-items: center;
-            border-bottom: 1px solid #444;
-            flex-wrap: wrap;
-        }
-        .toolbar input {
-            flex: 1;
-            min-width: 300px;
-            padding: 8px 12px;
-            border: 1px solid #444;
-            border-radius: 4px;
-            background: #333;
-            color: #fff;
-            font-size: 14px;
-        }
-        .toolbar button {
-            padding: 8px 16px;
-            background: #0066cc;
-            color: white;
-            border: none;
-            border-radius: 4px;
-            cursor: pointer;
-            font-weight: 600;
-            transition: background 0.2s;
-        }
-        .toolbar button:hover { background: #0052a3; }
-        .toolbar button:active { background: #003d7a; }
-        .info {
-            color: #888;
-            font-size: 13px;
-            padding: 0 8px;
-            white-space: nowrap;
-        }
-        .browser-container {
-            flex: 1;
-            overflow: auto;
-            background: white;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            position: relative;
-        }
-        #screenshot {
-            max-width: 100%;
-            max-height: 100%;
-            object-fit: contain;
-            cursor: pointer;
-            box-shadow: 0 2px 10px rgba(0,0,0,0.3);
-        }
-        .loading {
-            color: #888;
-            font-size: 14px;
-        }
-        .status-bar {
-            background: #222;
-            padding: 8px 15px;
-            border-top: 1px solid #444;
-            font-size: 12px;
-            color: #888;
-            display: flex;
-            gap: 20px;
-        }
-        .status-item { display: flex; gap: 6px; align-items: center; }
-        .status-dot {
-            width: 8px;
-            height: 8px;
-            border-radius: 50%;
-            background: #0f0;
-        }
-        .status-dot.error { background: #f00; }
-    </style>
-</head>
-<body>
-    <div class="toolbar">
-        <input type="text" id="urlInput" placeholder="Enter URL..." value="https://google.com">
-        <button onclick="navigateTo()">Go</button>
-        <button onclick="refreshScreenshot()">Refresh</button>
-        <span class="info" id="loadingIndicator">Loading...</span>
-    </div>
-    
-    <div class="browser-container">
-        <div id="content">
-            <div class="loading">Initializing browser...</div>
-        </div>
-    </div>
-
-    <div class="status-bar">
-        <div class="status-item">
-            <div class="status-dot" id="statusDot"></div>
-            <span id="statusText">Connecting...</span>
-        </div>
-        <div class="status-item" id="urlStatus"></div>
-    </div>
-
-    <script>
-        const urlInput = document.getElementById('urlInput');
-        const content = document.getElementById('content');
-        const loadingIndicator = document.getElementById('loadingIndicator');
-        const statusText = document.getElementById('statusText');
-        const statusDot = document.getElementById('statusDot');
-        const urlStatus = document.getElementById('urlStatus');
-
-        async function refreshScreenshot() {
-            try {
-                loadingIndicator.textContent = 'Capturing...';
-                const response = await fetch('/api/screenshot');
-                if (!response.ok) throw new Error('Capture failed');
-                
-                const data = await response.json();
-                const img = document.createElement('img');
-                img.id = 'screenshot';
-                img.src = 'data:image/jpeg;base64,' + data.screenshot;
-                img.onclick = handleClick;
-                
-                content.innerHTML = '';
-                content.appendChild(img);
-                
-                statusDot.classList.remove('error');
-                statusText.textContent = '✓ Connected';
-                urlStatus.textContent = data.url || '';
-                urlInput.value = data.url || urlInput.value;
-                loadingIndicator.textContent = 'Ready';
-                
-            } catch (e) {
-                statusDot.classList.add('error');
-                statusText.textContent = '✗ Error: ' + e.message;
-                loadingIndicator.textContent = 'Error';
-                content.innerHTML = `<div class="loading" style="color: #f00;">Error: ${e.message}</div>`;
-            }
-        }
-
-        async function navigateTo() {
-            const url = urlInput.value || 'https://google.com';
-            try {
-                loadingIndicator.textContent = 'Navigating...';
-                const response = await fetch('/api/navigate', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ url })
-                });
-                if (!response.ok) throw new Error('Navigation failed');
-                
-                await new Promise(r => setTimeout(r, 800));
-                await refreshScreenshot();
-            } catch (e) {
-                statusDot.classList.add('error');
-                statusText.textContent = '✗ ' + e.message;
-                loadingIndicator.textContent = 'Failed';
-            }
-        }
-
-        async function handleClick(e) {
-            const rect = e.target.getBoundingClientRect();
-            const x = Math.round((e.clientX - rect.left) * (e.target.naturalWidth / rect.width));
-            const y = Math.round((e.clientY - rect.top) * (e.target.naturalHeight / rect.height));
-            
-            try {
-                await fetch('/api/click', {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ x, y })
-                });
-                await new Promise(r => setTimeout(r, 400));
-                await refreshScreenshot();
-            } catch (e) {
-                console.error('Click failed:', e);
-            }
-        }
-
-        document.addEventListener('keypress', async (e) => {
-            if (e.target === urlInput) {
-                if (e.key === 'Enter') navigateTo();
-                return;
-            }
-        });
-
-        setInterval(refreshScreenshot, 1000);
-        setTimeout(refreshScreenshot, 300);
-    </script>
-</body>
-</html>'''
-
-def get_event_loop():
-    global loop
-    with lock:
-        try:
-            loop = asyncio.get_event_loop()
-            if loop.is_closed():
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        return loop
+sessions = None
+loop_thread = LoopThread()
+browser_ready = threading.Event()
+browser_task = None
+maintenance_task = None
+started_at = time.monotonic()
+LONG_POLL_TIMEOUT = 10
+STREAM_KEEPALIVE = 15
+MAX_SESSIONS = int(os.environ.get('MAX_SESSIONS', 8))
+WARM_PAGES = int(os.environ.get('WARM_PAGES', 2))
+# seconds without input before a session's page is closed and its state
+# kept for a later restore; 0 disables hibernation
+HIBERNATE_AFTER = int(os.environ.get('HIBERNATE_AFTER', 300))
+PORT = int(os.environ.get('PORT', 5000))
+# how long a request waits for a browser that is still starting
+BROWSER_WAIT = float(os.environ.get('BROWSER_WAIT', 30))
+USER_DATA_DIR = os.environ.get('USER_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.chrome-profile'))
+# request interception needs the Fetch domain, which pyppeteer's bundled
+# Chromium predates; point CHROME_PATH at a current build to use it
+CHROME_PATH = os.environ.get('CHROME_PATH')
+RESOURCE_CACHE = os.environ.get('RESOURCE_CACHE', '0') == '1'
+BLOCK_RESOURCES = parse_policy(os.environ.get('BLOCK_RESOURCES', ''))
+resource_cache = DiskCache() if RESOURCE_CACHE else None
+snapshot_store = SnapshotStore.open(SESSION_STORE)
+# how long a shutdown may spend saving sessions; the router waits 10s
+SHUTDOWN_TIMEOUT = float(os.environ.get('SHUTDOWN_TIMEOUT', 8))
+# log one line per request with its stage timings
+TRACE = os.environ.get('TRACE', '0') == '1'
+static_assets = load_static()
+page_asset = load_page(static_assets)
+
+def chromium_rss():
+    process = getattr(browser, 'process', None)
+    if process is None:
+        return None
+    return sum(rss_bytes(pid) for pid in process_tree(process.pid))
+
+registry.gauge('uc_active_sessions', 'Sessions with an open page.',
+               lambda: len(sessions.live()) if sessions is not None else 0)
+registry.gauge('uc_hibernated_sessions', 'Sessions kept as frozen state without a page.',
+               lambda: len(sessions.hibernated()) if sessions is not None else 0)
+registry.gauge('uc_open_pages', 'Open pages, including warm spares.',
+               lambda: sessions.page_count() if sessions is not None else 0)
+registry.gauge('uc_browser_ready', 'Whether the browser is up.',
+               lambda: int(browser_ready.is_set()))
+registry.gauge('uc_chromium_rss_bytes', 'Resident memory of Chromium and its children.',
+               chromium_rss)
+registry.gauge('uc_process_rss_bytes', 'Resident memory of this server process.',
+               lambda: rss_bytes(os.getpid()))
+registry.gauge('uc_resource_cache_hit_ratio', 'Share of cacheable page requests served from disk.',
+               lambda: resource_cache.stats()['hit_rate'] if resource_cache else None)
+
+def run(coro, timeout=None):
+    return loop_thread.run(coro, timeout)
 
 async def init_browser_async():
-    global browser, page
+    global browser, sessions, maintenance_task
     try:
-        if browser is not None and page is not None:
+        if browser is not None and sessions is not None:
             return True
         print("Initializing browser with pyppeteer...", file=sys.stderr, flush=True)
-        browser = await launch(headless=True, args=['--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu', '--single-process'], autoClose=False)
-        page = await browser.newPage()
-        await page.setViewport({'width': 1280, 'height': 720})
-        await page.goto('https://google.com', {'waitUntil': 'load', 'timeout': 10000})
-        print("Browser ready!", file=sys.stderr, flush=True)
+        launch_started = time.monotonic()
+        # signal handlers can only be installed from the main thread
+        browser = await launch(headless=True, args=['--no-sandbox', '--disable-dev-shm-usage', '--disable-gpu'], autoClose=False,
+                               userDataDir=USER_DATA_DIR, executablePath=CHROME_PATH,
+                               handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False)
+        browser.on('disconnected', on_browser_disconnected)
+        launched = time.monotonic()
+        sessions = SessionManager(browser, max_sessions=MAX_SESSIONS,
+                                  idle_timeout=SESSION_IDLE_TIMEOUT, warm_pages=WARM_PAGES,
+                                  cache=resource_cache, blocked=BLOCK_RESOURCES,
+                                  hibernate_after=HIBERNATE_AFTER or None,
+                                  snapshots=snapshot_store)
+        await sessions.prewarm()
+        maintenance_task = asyncio.ensure_future(sessions.maintain())
+        print(f"Browser ready! launch {launched - launch_started:.2f}s, "
+              f"{WARM_PAGES} warm pages {time.monotonic() - launched:.2f}s, "
+              f"{time.monotonic() - started_at:.2f}s since startup", file=sys.stderr, flush=True)
         return True
     except Exception as e:
         print(f"Init error: {e}", file=sys.stderr, flush=True)
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:
+                pass
         browser = None
-        page = None
+        sessions = None
         return False
 
-def init_browser():
-    loop = get_event_loop()
-    return loop.run_until_complete(init_browser_async())
+async def keep_browser():
+    delay = 1
+    while not await init_browser_async():
+        print(f"Retrying browser launch in {delay}s", file=sys.stderr, flush=True)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60)
+    browser_ready.set()
 
-def compress_screenshot(screenshot_data, quality=75):
-    try:
-        img = Image.open(io.BytesIO(screenshot_data))
-        buffer = io.BytesIO()
-        img.save(buffer, format='JPEG', quality=quality, optimize=True)
-        return base64.b64encode(buffer.getvalue()).decode('utf-8')
-    except:
-        return base64.b64encode(screenshot_data).decode('utf-8')
+def start_browser():
+    """Launch the browser in the background, retrying with backoff, so
+    requests never pay for a launch inline."""
+    global browser_task
+    if browser_task is None or browser_task.done():
+        browser_task = loop_thread.submit(keep_browser())
+
+def on_browser_disconnected():
+    global browser, sessions, maintenance_task
+    print("Browser disconnected, relaunching", file=sys.stderr, flush=True)
+    browser_ready.clear()
+    # the old manager's sessions died with the browser
+    if maintenance_task is not None:
+        loop_thread.call_soon(maintenance_task.cancel)
+        maintenance_task = None
+    browser = None
+    sessions = None
+    start_browser()
+
+def get_session():
+    if not browser_ready.wait(BROWSER_WAIT):
+        start_browser()
+        raise RuntimeError('Browser is still starting')
+    session_id = request.cookies.get(SESSION_COOKIE)
+    if not session_id:
+        session_id = g.new_session_id = uuid.uuid4().hex
+    session = run(sessions.acquire(session_id))
+    if session.hibernated and session.broadcaster.latest() is None:
+        # restored from a snapshot: there is nothing to show until it loads
+        run(sessions.wake(session))
+    return session
+
+def live_session():
+    """The session for a request that acts on the page: restored first if
+    it was hibernated, and kept awake by counting as input."""
+    session = get_session()
+    run(sessions.wake(session))
+    session.mark_input()
+    return session
 
 @app.route('/')
 def index():
-    return HTML_CONTENT, 200, {'Content-Type': 'text/html; charset=utf-8'}
+    if not request.cookies.get(SESSION_COOKIE):
+        g.new_session_id = uuid.uuid4().hex
+    return page_asset.response(request)
+
+@app.route('/static/<name>')
+def static_asset(name):
+    asset = static_assets.get(name)
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+    # only the exact version the page links to may be cached for good
+    current = request.args.get('v') == asset.version
+    return asset.response(request, IMMUTABLE if current else REVALIDATE)
+
+def frame_key(session, format, quality=None):
+    settings = session.quality.settings
+    quality = quality or settings['quality']
+    return (format, None if format == 'png' else quality, settings['scale'])
+
+def capture(session, viewer, key, timings):
+    """Return the session's shared frame for ``key``. With an ``after``
+    query argument this long-polls for a frame newer than that sequence."""
+    after = request.args.get('after', type=int)
+    if after is None:
+        return run(session.broadcaster.get(viewer, key, timings))
+    timeout = min(request.args.get('timeout', LONG_POLL_TIMEOUT, type=float), LONG_POLL_TIMEOUT)
+    with timings.stage('wait'), poll_slot(timeout) as timeout:
+        return run(session.broadcaster.next_frame(viewer, key, after, timeout))
+
+@contextmanager
+def poll_slot(timeout):
+    """Yield how long a long poll may wait: ``timeout`` with a long-request
+    slot, and only a short wait once they are all taken."""
+    if not long_requests.acquire(blocking=False):
+        yield min(timeout, SHORT_POLL_TIMEOUT)
+        return
+    try:
+        yield timeout
+    finally:
+        long_requests.release()
+
+def viewer_id():
+    return request.args.get('client') or f'{request.remote_addr}:{request.cookies.get(SESSION_COOKIE)}'
+
+def timed(response, timings):
+    response.headers['Server-Timing'] = timings.header()
+    return response
 
 @app.route('/api/screenshot')
 def screenshot():
-    global page, last_screenshot, last_screenshot_time
     try:
-        import time
-        now = time.time()
-        if last_screenshot and (now - last_screenshot_time) < 0.5:
-            return jsonify(last_screenshot)
-        
-        with lock:
-            if not page:
-                if not init_browser():
-                    return jsonify({'error': 'Browser init failed'}), 500
-            
-            loop = get_event_loop()
-            screenshot_data = loop.run_until_complete(page.screenshot({'type': 'png'}))
-            screenshot_b64 = compress_screenshot(screenshot_data, quality=70)
-            url = page.url
+        timings = Timings()
+        session = get_session()
+        captured = capture(session, viewer_id(), frame_key(session, 'jpeg'), timings)
+        with timings.stage('base64'):
+            screenshot_b64 = base64.b64encode(captured['data']).decode('utf-8')
         
-        result = {'screenshot': screenshot_b64, 'url': url, 'title': 'Browser'}
-        last_screenshot = result
-        last_screenshot_time = now
-        return jsonify(result)
+        return timed(jsonify({'screenshot': screenshot_b64, 'url': captured['url'],
+                              'title': captured['title'], 'seq': captured['seq']}), timings)
     except Exception as e:
         print(f"Screenshot error: {e}", file=sys.stderr, flush=True)
         return jsonify({'error': str(e)}), 500
 
+def delta_frame(session, client_id, keyframe, timings, captured=None):
+    if captured is None:
+        captured = capture(session, client_id, frame_key(session, 'png'), timings)
+    if 'pixels' not in captured['derived']:
+        with timings.stage('decode'):
+            captured['derived']['pixels'] = in_pool(decode_frame, captured['data'])
+    quality = session.quality.settings['quality']
+    with timings.stage('encode'):
+        result = in_pool(session.delta.encode, client_id, captured['derived']['pixels'],
+                         keyframe=keyframe, quality=quality)
+    if result['keyframe']:
+        session.quality.observe(len(result['tiles'][0]['data']) * 3 // 4,
+                                result['width'], result['height'], quality)
+    result['url'] = captured['url']
+    result['seq'] = captured['seq']
+    result['viewport'] = session.viewport
+    return result
+
+@app.route('/api/screenshot/delta')
+def screenshot_delta():
+    try:
+        timings = Timings()
+        client_id = request.args.get('client', request.remote_addr)
+        keyframe = request.args.get('keyframe') == '1'
+        session = get_session()
+        return timed(jsonify(delta_frame(session, client_id, keyframe, timings)), timings)
+    except Exception as e:
+        print(f"Delta screenshot error: {e}", file=sys.stderr, flush=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/frame')
+def frame():
+    try:
+        timings = Timings()
+        session = get_session()
+        format = request.args.get('format', session.quality.settings['format'])
+        if format not in MIMETYPES:
+            return jsonify({'error': f'Unsupported format {format}'}), 400
+        quality = request.args.get('quality', type=int)
+        captured = capture(session, viewer_id(), frame_key(session, format, quality), timings)
+        data, etag = captured['data'], captured['etag']
+
+        headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache',
+                   'X-Page-URL': captured['url'], 'X-Frame-Seq': str(captured['seq']),
+                   'Server-Timing': timings.header()}
+        if etag in request.if_none_match:
+            return '', 304, headers
+        # a hibernated session may answer with a frame of another format
+        return data, 200, dict(headers, **{'Content-Type': MIMETYPES[captured['key'][0]]})
+    except Exception as e:
+        print(f"Frame error: {e}", file=sys.stderr, flush=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/client-info', methods=['POST'])
+def client_info():
+    try:
+        info = request.json or {}
+        session = get_session()
+        settings = session.quality.report(
+            width=info.get('width'), height=info.get('height'), dpr=info.get('dpr', 1.0),
+            throughput=info.get('throughput'), rtt=info.get('rtt'), webp=info.get('webp', False))
+        if session.screencaster is not None:
+            run(configure_screencaster(session.screencaster, settings))
+        return jsonify(settings)
+    except Exception as e:
+        print(f"Client info error: {e}", file=sys.stderr, flush=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/health')
+def health():
+    """Liveness for the router; ``ready`` once the browser is up."""
+    return jsonify({'ready': browser_ready.is_set(), 'pid': os.getpid(),
+                    'sessions': len(sessions) if sessions is not None else 0,
+                    'uptime': round(time.monotonic() - started_at, 1)})
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4',
+                    headers={'Cache-Control': 'no-store'})
+
+@app.route('/api/status')
+def status():
+    try:
+        session = sessions and sessions.get(request.cookies.get(SESSION_COOKIE))
+        if not session:
+            return jsonify({'ready': False})
+        latest = session.broadcaster.latest()
+        if session.hibernated:
+            return jsonify({'ready': True, 'hibernated': True,
+                            'url': latest['url'] if latest else session.state.get('url'),
+                            'title': latest['title'] if latest else '',
+                            'viewers': session.broadcaster.viewer_count(),
+                            'captures': session.broadcaster.captures})
+        if latest and time.monotonic() - latest['time'] < session.broadcaster.interval:
+            title = latest['title']
+        else:
+            title = run(session.page.title())
+        return jsonify({'ready': True, 'hibernated': False, 'url': session.page.url,
+                        'title': title, 'viewers': session.broadcaster.viewer_count(),
+                        'captures': session.broadcaster.captures})
+    except Exception as e:
+        print(f"Status error: {e}", file=sys.stderr, flush=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/resources', methods=['GET', 'POST'])
+def resources():
+    """Cache hit rates and this session's blocked resource classes; POST
+    ``{"block": ["ads", "trackers"]}`` to change what is blocked."""
+    try:
+        session = live_session() if request.method == 'POST' else get_session()
+        if request.method == 'POST':
+            blocked = parse_policy(','.join((request.json or {}).get('block', [])))
+            with session.locked():
+                if session.interceptor is None:
+                    session.interceptor = run(sessions.intercept(session.cdp))
+                if session.interceptor is None:
+                    return jsonify({'error': 'Request interception is not supported'}), 501
+                session.interceptor.blocked = blocked
+        return jsonify({
+            'classes': sorted(BLOCK_CLASSES),
+            'session': session.interceptor.stats() if session.interceptor else None,
+            'cache': resource_cache.stats() if resource_cache else None,
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Resources error: {e}", file=sys.stderr, flush=True)
+        return jsonify({'error': str(e)}), 500
+
+async def configure_screencaster(caster, settings):
+    # screencast frames can only be JPEG or PNG
+    await caster.configure(format='jpeg', quality=settings['quality'],
+                           max_width=settings['width'], max_height=settings['height'],
+                           fps=settings['fps'])
+
+def get_screencaster(session):
+    if session.screencaster is None:
+        settings = session.quality.settings
+        session.screencaster = Screencaster(session.page, quality=settings['quality'],
+                                            max_width=settings['width'],
+                                            max_height=settings['height'],
+                                            fps=settings['fps'],
+                                            on_frame=lambda: session.activity.poke('paint'),
+                                            capture_lock=session.capture_lock)
+    return session.screencaster
+
+def sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+def join_stream(session, client_id):
+    with session.locked():
+        caster = get_screencaster(session)
+        run(caster.add_client(client_id))
+    return caster
+
+def frozen_frame(session):
+    """The last frame of a hibernated session, shaped like a screencast frame."""
+    frame = session.broadcaster.latest()
+    if frame is None:
+        return None
+    # width in CSS pixels, like a screencast frame's, whatever the scale
+    return {'seq': frame['seq'], 'data': base64.b64encode(frame['data']).decode(),
+            'format': frame['key'][0], 'width': session.viewport['width'],
+            'url': frame['url']}
+
+@app.route('/api/stream')
+def stream():
+    """Screencast frames as server-sent events. The stream stays open while
+    the session hibernates, showing its last frame, and picks the screencast
+    up again once input wakes it."""
+    client_id = uuid.uuid4().hex
+    if not long_requests.acquire(blocking=False):
+        # clients fall back to polling
+        return jsonify({'error': 'Too many streams'}), 503, {'Retry-After': '30'}
+    try:
+        session = get_session()
+        caster = None if session.hibernated else join_stream(session, client_id)
+    except Exception as e:
+        long_requests.release()
+        print(f"Stream error: {e}", file=sys.stderr, flush=True)
+        return jsonify({'error': str(e)}), 500
+
+    def generate():
+        nonlocal caster
+        last_write = time.time()
+        frozen_sent = False
+        try:
+            yield sse('hello', {'client': client_id})
+            while sessions is not None and sessions.sessions.get(session.id) is session:
+                if session.hibernated:
+                    # the screencaster stopped with the page
+                    caster = None
+                    frame = None if frozen_sent else frozen_frame(session)
+                    frozen_sent = True
+                    if frame is None:
+                        time.sleep(1.0)
+                elif caster is None:
+                    caster, frozen_sent = join_stream(session, client_id), False
+                    continue
+                else:
+                    frame = run(caster.next_frame(client_id, timeout=1.0))
+                    session.touch()
+                    if frame is not None:
+                        frame = dict(frame, url=session.page.url)
+                if frame is not None:
+                    yield sse('frame', frame)
+                    last_write = time.time()
+                elif time.time() - last_write > STREAM_KEEPALIVE:
+                    yield ': keepalive\n\n'
+                    last_write = time.time()
+        finally:
+            if caster is not None:
+                run(caster.remove_client(client_id))
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'X-Accel-Buffering': 'no'})
+    # runs even if the stream is closed before it starts
+    response.call_on_close(long_requests.release)
+    return response
+
+@app.route('/api/stream/ack', methods=['POST'])
+def stream_ack():
+    client_id = request.json.get('client')
+    seq = int(request.json.get('seq', 0))
+    session = sessions and sessions.get(request.cookies.get(SESSION_COOKIE))
+    if not session or not session.screencaster or not session.screencaster.ack(client_id, seq):
+        return jsonify({'error': 'Unknown client'}), 404
+    return jsonify({'status': 'ok'})
+
+async def start_navigation(session, url):
+    return session.navigator.start(url).to_dict()
+
 @app.route('/api/navigate', methods=['POST'])
 def navigate():
-    global page
+    """Start loading ``url`` and return at once with a job id; follow its
+    progress on ``/api/navigate/<job>``."""
     try:
-        with lock:
-            if not page:
-                if not init_browser():
-                    return jsonify({'error': 'Browser not ready'}), 500
-            
-            url = request.json.get('url', 'https://google.com')
-            if not url.startswith(('http://', 'https://')):
-                url = 'https://' + url
-            
-            loop = get_event_loop()
-            loop.run_until_complete(page.goto(url, {'waitUntil': 'load', 'timeout': 15000}))
-            return jsonify({'status': 'ok', 'url': page.url})
+        session = live_session()
+        url = request.json.get('url', 'https://google.com')
+        if not url.startswith(('http://', 'https://')):
+            url = 'https://' + url
+        job = run(start_navigation(session, url))
+        return jsonify(dict(job, status='started')), 202
     except Exception as e:
         print(f"Navigate error: {e}", file=sys.stderr, flush=True)
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/navigate/<job_id>')
+def navigation_status(job_id):
+    """Long-poll a navigation job for events after the ``after``-th one."""
+    try:
+        session = live_session()
+        job = session.navigator.jobs.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Unknown navigation'}), 404
+        after = request.args.get('after', 0, type=int)
+        timeout = min(request.args.get('timeout', LONG_POLL_TIMEOUT, type=float),
+                      LONG_POLL_TIMEOUT)
+        with poll_slot(timeout) as timeout:
+            run(job.wait(after, timeout))
+        return jsonify(dict(job.to_dict(after), page_url=session.page.url))
+    except Exception as e:
+        print(f"Navigation status error: {e}", file=sys.stderr, flush=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/tiles')
+def tile_layout():
+    """The whole document's size and tiling, for scrolling through it
+    locally; tiles come from ``/api/tiles/<index>``."""
+    try:
+        session = live_session()
+        return jsonify(run(session.tiles.layout()))
+    except Exception as e:
+        print(f"Tile layout error: {e}", file=sys.stderr, flush=True)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/tiles/<int:index>')
+def tile(index):
+    """One tile of the document, in the session's frame encoding. Its
+    ``X-Doc-Version`` tells the client when tiles it holds went stale."""
+    try:
+        timings = Timings()
+        session = live_session()
+        settings = session.quality.settings
+        format = 'jpeg' if settings['format'] == 'png' else settings['format']
+        with timings.stage('tile'):
+            captured = run(session.tiles.tile(index, format, settings['quality'],
+                                              settings['scale']))
+        headers = {'ETag': f'"{captured["etag"]}"', 'Cache-Control': 'no-cache',
+                   'X-Doc-Version': captured['version'], 'Server-Timing': timings.header()}
+        if captured['etag'] in request.if_none_match:
+            return '', 304, headers
+        return captured['data'], 200, dict(headers, **{'Content-Type': MIMETYPES[format]})
+    except IndexError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        print(f"Tile error: {e}", file=sys.stderr, flush=True)
+        return jsonify({'error': str(e)}), 500
+
+async def input_sent(session):
+    # the broadcaster and the tracker's wakeup event belong to the loop thread
+    session.broadcaster.invalidate()
+    session.activity.poke('input')
+
+def send_input(session, events, timings):
+    with session.locked(timings):
+        with timings.stage('dispatch'):
+            sent = run(dispatch(session.cdp, events))
+        with timings.stage('settle'):
+            run(settle(session.cdp))
+        # shared frames captured before the input are stale now
+        run(input_sent(session))
+    return sent
+
+@app.route('/api/input', methods=['POST'])
+def input_events():
+    try:
+        timings = Timings()
+        body = request.json or {}
+        session = live_session()
+        sent = send_input(session, body.get('events', []), timings)
+        result = {'status': 'ok', 'dispatched': sent}
+        if body.get('frame') == 'delta':
+            result['frame'] = delta_frame(session, body.get('client', request.remote_addr),
+                                          False, timings)
+        return timed(jsonify(result), timings)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Input error: {e}", file=sys.stderr, flush=True)
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/click', methods=['POST'])
 def click():
-    global page
     try:
-        with lock:
-            if not page:
-                return jsonify({'error': 'Browser not ready'}), 500
-            
-            x = request.json.get('x', 0)
-            y = request.json.get('y', 0)
-            
-            loop = get_event_loop()
-            loop.run_until_complete(page.click({'x': x, 'y': y}))
+        session = live_session()
+        x = request.json.get('x', 0)
+        y = request.json.get('y', 0)
+        send_input(session, [{'type': 'click', 'x': x, 'y': y}], Timings())
         return jsonify({'status': 'ok'})
     except Exception as e:
         print(f"Click error: {e}", file=sys.stderr, flush=True)
@@ -336,29 +575,64 @@ def click():
 
 @app.route('/api/type', methods=['POST'])
 def type_text():
-    global page
     try:
-        with lock:
-            if not page:
-                return jsonify({'error': 'Browser not ready'}), 500
-            
-            text = request.json.get('text', '')
-            loop = get_event_loop()
-            loop.run_until_complete(page.type(text))
+        session = live_session()
+        text = request.json.get('text', '')
+        send_input(session, [{'type': 'text', 'text': text}], Timings())
         return jsonify({'status': 'ok'})
     except Exception as e:
         print(f"Type error: {e}", file=sys.stderr, flush=True)
         return jsonify({'error': str(e)}), 500
 
+@app.before_request
+def start_trace():
+    if TRACE:
+        g.trace_started = time.perf_counter()
+
 @app.after_request
 def add_headers(response):
-    response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-    response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = '*'
-    response.headers['Connection'] = 'close'
+    if TRACE and 'trace_started' in g:
+        print(json.dumps({
+            'method': request.method, 'path': request.path, 'status': response.status_code,
+            'ms': round((time.perf_counter() - g.trace_started) * 1000, 1),
+            'session': request.cookies.get(SESSION_COOKIE),
+            'timing': response.headers.get('Server-Timing'),
+        }), file=sys.stderr, flush=True)
+    if request.path.startswith('/api/'):
+        # frame responses set their own Cache-Control so ETags can revalidate
+        response.headers.setdefault('Cache-Control', 'no-cache, no-store, must-revalidate')
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = '*'
+    if 'new_session_id' in g:
+        # outlive the browser session when sessions survive restarts
+        response.set_cookie(SESSION_COOKIE, g.new_session_id, httponly=True, samesite='Lax',
+                            max_age=SNAPSHOT_MAX_AGE if snapshot_store else None)
     return response
 
+def shutdown():
+    """Save every session's state and close Chromium before the process
+    exits."""
+    started = time.monotonic()
+    if sessions is not None:
+        try:
+            run(sessions.close_all(), SHUTDOWN_TIMEOUT)
+        except Exception as e:
+            print(f"Shutdown error: {e}", file=sys.stderr, flush=True)
+        print(f"Closed sessions in {time.monotonic() - started:.2f}s", file=sys.stderr, flush=True)
+    if browser is not None:
+        # launched with autoClose off, Chromium would outlive this process
+        browser.remove_listener('disconnected', on_browser_disconnected)
+        try:
+            run(browser.close(), SHUTDOWN_TIMEOUT)
+        except Exception as e:
+            print(f"Browser close error: {e}", file=sys.stderr, flush=True)
+
 if __name__ == '__main__':
-    init_browser()
-    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True, use_reloader=False)
+    # the router stops workers with SIGTERM; let the server return normally
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    start_browser()
+    try:
+        serve(app, PORT)
+    finally:
+        shutdown()
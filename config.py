@@ -0,0 +1,5 @@
+import os
+
+# settings shared by browser_app and the router in front of it
+SESSION_COOKIE = 'uc_session'
+SESSION_IDLE_TIMEOUT = int(os.environ.get('SESSION_IDLE_TIMEOUT', 600))
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+from collections.abc import MutableMapping
+
+BLOB_KEY = "cookies"
+BLOB_VERSION = 1
+
+# the fields Network.setCookies accepts
+COOKIE_FIELDS = ("name", "value", "domain", "path", "secure", "httpOnly",
+                 "sameSite", "expires")
+
+
+def cookie_key(cookie: dict) -> str:
+    return "\t".join((cookie.get("domain", ""), cookie.get("path", "/"),
+                      cookie["name"]))
+
+
+def cookie_hash(cookie: dict) -> str:
+    encoded = json.dumps(cookie, sort_keys=True).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def normalize(cookie: dict) -> dict:
+    """Convert a WebDriver or CDP cookie into a CDP ``CookieParam``."""
+    cookie = dict(cookie)
+    if "expiry" in cookie:
+        cookie["expires"] = cookie.pop("expiry")
+    if cookie.get("expires", -1) in (-1, None) or cookie.get("session"):
+        cookie.pop("expires", None)
+    return {field: cookie[field] for field in COOKIE_FIELDS if field in cookie}
+
+
+def is_expired(cookie: dict, now: float | None = None) -> bool:
+    expires = cookie.get("expires")
+    return expires is not None and expires < (now or time.time())
+
+
+class CookieStore:
+    """Persists cookies as one compact blob, rewritten only when a cookie
+    was added, changed or expired since the last save."""
+
+    def __init__(self, db: MutableMapping, key: str = BLOB_KEY):
+        self.db = db
+        self.key = key
+        self._saved: dict[str, str] = {}
+
+    def exists(self) -> bool:
+        return self.key in self.db or bool(self._legacy_keys())
+
+    def _legacy_keys(self) -> list[str]:
+        # v1 stored one cookie per numeric key
+        return [key for key in self.db.keys() if key.isnumeric()]
+
+    def load(self) -> list[dict]:
+        blob = self.db.get(self.key)
+        if blob is not None:
+            cookies = [dict(cookie) for cookie in blob["cookies"]]
+        else:
+            cookies = [normalize(self.db[key]) for key in
+                       sorted(self._legacy_keys(), key=int)]
+        cookies = [cookie for cookie in cookies if not is_expired(cookie)]
+        self._saved = {cookie_key(cookie): cookie_hash(cookie)
+                       for cookie in cookies}
+        return cookies
+
+    def diff(self, cookies: list[dict]) -> tuple[list[str], list[str], list[str]]:
+        current = {cookie_key(cookie): cookie_hash(cookie) for cookie in cookies}
+        added = [key for key in current if key not in self._saved]
+        changed = [key for key in current
+                   if key in self._saved and current[key] != self._saved[key]]
+        removed = [key for key in self._saved if key not in current]
+        return added, changed, removed
+
+    def save(self, cookies: list[dict]) -> tuple[list[str], list[str], list[str]] | None:
+        """Write ``cookies`` if they differ from what was last saved.
+        Returns the (added, changed, removed) keys, or None if unchanged."""
+        now = time.time()
+        cookies = [normalize(cookie) for cookie in cookies]
+        cookies = [cookie for cookie in cookies if not is_expired(cookie, now)]
+        added, changed, removed = self.diff(cookies)
+        if not (added or changed or removed):
+            return None
+        self.db[self.key] = {"version": BLOB_VERSION, "cookies": cookies}
+        for key in self._legacy_keys():
+            del self.db[key]
+        self._saved = {cookie_key(cookie): cookie_hash(cookie)
+                       for cookie in cookies}
+        return added, changed, removed
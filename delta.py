@@ -0,0 +1,97 @@
+import base64
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from frames import reusable_buffer
+
+TILE_SIZE = 64
+KEYFRAME_INTERVAL = 30
+# above this share of dirty tiles a single full frame is cheaper
+KEYFRAME_THRESHOLD = 0.6
+MAX_CLIENTS = 32
+
+
+def decode_frame(data):
+    return np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))
+
+
+def dirty_tiles(previous, current, tile=TILE_SIZE):
+    """Return a (rows, cols) bool grid of tiles that differ between frames."""
+    height, width = current.shape[:2]
+    rows = -(-height // tile)
+    cols = -(-width // tile)
+    changed = np.any(previous != current, axis=2)
+    padded = np.zeros((rows * tile, cols * tile), dtype=bool)
+    padded[:height, :width] = changed
+    return padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+
+def encode_region(frame, x, y, w, h, quality):
+    buffer = reusable_buffer()
+    Image.fromarray(frame[y:y + h, x:x + w]).save(buffer, format='JPEG',
+                                                  quality=quality)
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+
+class _ClientState:
+
+    def __init__(self, frame):
+        self.frame = frame
+        self.since_keyframe = 0
+
+
+class DeltaEncoder:
+    """Encodes captured frames as the tiles that changed for each client."""
+
+    def __init__(self, tile=TILE_SIZE, quality=70,
+                 keyframe_interval=KEYFRAME_INTERVAL, max_clients=MAX_CLIENTS):
+        self.tile = tile
+        self.quality = quality
+        self.keyframe_interval = keyframe_interval
+        self.max_clients = max_clients
+        self.clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, client_id, frame, keyframe=False, quality=None):
+        with self._lock:
+            return self._encode(client_id, frame, keyframe,
+                                quality or self.quality)
+
+    def _encode(self, client_id, frame, keyframe, quality):
+        height, width = frame.shape[:2]
+        state = self.clients.get(client_id)
+        if (state is None or state.frame.shape != frame.shape
+                or state.since_keyframe >= self.keyframe_interval):
+            keyframe = True
+
+        tiles = []
+        if not keyframe:
+            grid = dirty_tiles(state.frame, frame, self.tile)
+            if grid.mean() > KEYFRAME_THRESHOLD:
+                keyframe = True
+            else:
+                for row, col in zip(*np.nonzero(grid)):
+                    x, y = int(col) * self.tile, int(row) * self.tile
+                    w, h = min(self.tile, width - x), min(self.tile, height - y)
+                    tiles.append({'x': x, 'y': y, 'w': w, 'h': h,
+                                  'data': encode_region(frame, x, y, w, h,
+                                                        quality)})
+        if keyframe:
+            tiles = [{'x': 0, 'y': 0, 'w': width, 'h': height,
+                      'data': encode_region(frame, 0, 0, width, height,
+                                            quality)}]
+
+        if state is None:
+            state = self.clients[client_id] = _ClientState(frame)
+        state.frame = frame
+        state.since_keyframe = 0 if keyframe else state.since_keyframe + 1
+        self.clients.move_to_end(client_id)
+        while len(self.clients) > self.max_clients:
+            self.clients.popitem(last=False)
+
+        return {'keyframe': keyframe, 'width': width, 'height': height,
+                'tiles': tiles}
@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from metrics import STAGE_SECONDS
+
+MIMETYPES = {'jpeg': 'image/jpeg', 'webp': 'image/webp', 'png': 'image/png'}
+ENCODE_WORKERS = int(os.environ.get('ENCODE_WORKERS', min(4, os.cpu_count() or 1)))
+
+# PIL releases the GIL while coding images, so threads are enough here
+encode_pool = ThreadPoolExecutor(max_workers=ENCODE_WORKERS,
+                                 thread_name_prefix='encode')
+_buffers = threading.local()
+
+
+def reusable_buffer():
+    """Return this thread's scratch BytesIO, emptied for reuse."""
+    buffer = getattr(_buffers, 'buffer', None)
+    if buffer is None:
+        buffer = _buffers.buffer = io.BytesIO()
+    buffer.seek(0)
+    buffer.truncate()
+    return buffer
+
+
+class Timings:
+    """Per-stage wall-clock timings in milliseconds."""
+
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            self.stages[name] = self.stages.get(name, 0) + elapsed
+            STAGE_SECONDS.observe(elapsed / 1000, stage=name)
+
+    def header(self):
+        return ', '.join(f'{name};dur={elapsed:.1f}'
+                         for name, elapsed in self.stages.items())
+
+
+async def capture_screenshot(cdp, format='png', quality=70, scale=1.0,
+                             viewport=None):
+    """Capture the viewport already encoded by Chrome in ``format``,
+    downscaled by ``scale`` when a viewport size is given."""
+    params = {'format': format}
+    if format != 'png':
+        params['quality'] = quality
+    if viewport and scale < 1.0:
+        params['clip'] = {'x': 0, 'y': 0, 'width': viewport['width'],
+                          'height': viewport['height'], 'scale': scale}
+    result = await cdp.send('Page.captureScreenshot', params)
+    return base64.b64decode(result['data'])
+
+
+async def capture_region(cdp, x, y, width, height, format='jpeg', quality=70,
+                         scale=1.0):
+    """Capture a rectangle in page coordinates, which may lie outside the
+    viewport."""
+    params = {'format': format, 'captureBeyondViewport': True,
+              'clip': {'x': x, 'y': y, 'width': width, 'height': height,
+                       'scale': scale}}
+    if format != 'png':
+        params['quality'] = quality
+    result = await cdp.send('Page.captureScreenshot', params)
+    return base64.b64decode(result['data'])
+
+
+def frame_etag(data):
+    return hashlib.blake2b(data, digest_size=12).hexdigest()
+
+
+def in_pool(fn, *args, **kwargs):
+    return encode_pool.submit(fn, *args, **kwargs).result()
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import time
+
+from cookie_store import normalize
+
+# everything about the page that survives closing it, apart from cookies
+CAPTURE_SCRIPT = '''(() => {
+    function dump(storage) {
+        const items = {};
+        try {
+            for (let i = 0; i < storage.length; i++) {
+                const key = storage.key(i);
+                items[key] = storage.getItem(key);
+            }
+        } catch (e) {}
+        return items;
+    }
+    return {
+        url: location.href,
+        origin: location.origin,
+        scrollX: window.scrollX,
+        scrollY: window.scrollY,
+        localStorage: dump(window.localStorage),
+        sessionStorage: dump(window.sessionStorage),
+    };
+})()'''
+
+SEED_BINDING = '__ucSeeded'
+# seeds an origin's storage before the document's own scripts run, then
+# reports the origin so it is never seeded again
+SEED_SCRIPT = '''(() => {
+    const entry = (%(origins)s)[location.origin];
+    if (!entry) return;
+    function seed(storage, items) {
+        if (!items || storage.length) return;
+        for (const [key, value] of Object.entries(items)) storage.setItem(key, value);
+    }
+    try {
+        seed(localStorage, entry.localStorage);
+        seed(sessionStorage, entry.sessionStorage);
+    } catch (e) {}
+    try { window.%(binding)s(location.origin); } catch (e) {}
+})()'''
+
+RESTORE_TIMEOUT = 15000
+
+
+async def capture(session):
+    """Read ``session``'s URL, scroll position and cookies, and fold the
+    current origin's storage into ``session.origins``."""
+    cookies = (await session.cdp.send('Network.getAllCookies'))['cookies']
+    result = await session.cdp.send('Runtime.evaluate', {
+        'expression': CAPTURE_SCRIPT, 'returnByValue': True})
+    page = result.get('result', {}).get('value') or {'url': session.page.url}
+    origin = page.get('origin')
+    # opaque origins (about:blank, data: URLs) have no storage of their own
+    if origin and origin != 'null':
+        session.origins[origin] = {'localStorage': page.get('localStorage', {}),
+                                   'sessionStorage': page.get('sessionStorage', {})}
+    return {'url': page['url'], 'scrollX': page.get('scrollX', 0),
+            'scrollY': page.get('scrollY', 0),
+            'cookies': [normalize(cookie) for cookie in cookies],
+            'origins': dict(session.origins)}
+
+
+async def freeze(session):
+    """Capture what is needed to bring ``session``'s page back later, after
+    refreshing the frames of every key its viewers use."""
+    started = time.monotonic()
+    keys = session.broadcaster.active_keys() | set(session.broadcaster.slots)
+    if session.screencaster is not None and session.screencaster.clients or not keys:
+        # screencast viewers never ask the broadcaster, but need a frame too
+        settings = session.quality.settings
+        keys.add(('jpeg', settings['quality'], settings['scale']))
+    for key in keys:
+        await session.broadcaster.refresh(key)
+    state = await capture(session)
+    state['frozen_ms'] = round((time.monotonic() - started) * 1000)
+    return state
+
+
+class StorageSeeder:
+    """Seeds each saved origin's storage into a fresh page exactly once, on
+    the first document of that origin, so a page that later clears its own
+    storage (say, on logout) does not get it back.
+
+    The seed script lists only origins not seeded yet. It is replaced each
+    time one reports in, built from ``session.origins`` as it is then, and
+    removed once every origin has been seeded.
+    """
+
+    def __init__(self, session, origins):
+        self.session = session
+        self.pending = set(origins)
+        self.identifier = None
+        self._lock = asyncio.Lock()
+
+    async def install(self):
+        cdp = self.session.cdp
+        cdp.on('Runtime.bindingCalled', self._on_binding)
+        await cdp.send('Runtime.addBinding', {'name': SEED_BINDING})
+        await self._update()
+
+    def _on_binding(self, event):
+        if event.get('name') == SEED_BINDING and event.get('payload') in self.pending:
+            self.pending.discard(event['payload'])
+            asyncio.ensure_future(self._update())
+
+    async def _update(self):
+        async with self._lock:
+            cdp = self.session.cdp
+            if self.identifier is not None:
+                await cdp.send('Page.removeScriptToEvaluateOnNewDocument',
+                               {'identifier': self.identifier})
+                self.identifier = None
+            origins = {origin: self.session.origins[origin] for origin in self.pending
+                       if origin in self.session.origins}
+            if origins:
+                result = await cdp.send('Page.addScriptToEvaluateOnNewDocument', {
+                    'source': SEED_SCRIPT % {
+                        'origins': json.dumps(origins, separators=(',', ':')),
+                        'binding': SEED_BINDING}})
+                self.identifier = result['identifier']
+
+
+async def thaw(session, state):
+    """Load ``state`` into ``session``'s fresh page with one bulk call per
+    kind of storage: all cookies in one ``Network.setCookies``, all origins'
+    storage in one seed script that each origin runs once. Then the URL and
+    scroll position."""
+    cdp, page = session.cdp, session.page
+    session.origins = dict(state.get('origins', {}))
+    if state.get('cookies'):
+        await cdp.send('Network.setCookies', {'cookies': state['cookies']})
+    if session.origins:
+        await StorageSeeder(session, session.origins).install()
+    if state.get('url', 'about:blank') != 'about:blank':
+        await page.goto(state['url'], {'waitUntil': 'domcontentloaded',
+                                       'timeout': RESTORE_TIMEOUT})
+    if state.get('scrollX') or state.get('scrollY'):
+        await cdp.send('Runtime.evaluate', {'expression': 'window.scrollTo(%d, %d)' % (
+            state.get('scrollX', 0), state.get('scrollY', 0))})
@@ -0,0 +1,120 @@
+import asyncio
+
+from pyppeteer.us_keyboard_layout import keyDefinitions
+
+# CDP modifier bits
+MODIFIERS = {'alt': 1, 'ctrl': 2, 'meta': 4, 'shift': 8}
+EVENT_TYPES = ('click', 'move', 'mousedown', 'mouseup', 'wheel', 'keydown',
+               'keyup', 'text')
+SETTLE_TIMEOUT = 0.5
+SETTLE_SCRIPT = ('new Promise(resolve => requestAnimationFrame('
+                 '() => requestAnimationFrame(resolve)))')
+
+
+def modifier_mask(event):
+    return sum(bit for name, bit in MODIFIERS.items() if event.get(name))
+
+
+def coalesce(events):
+    """Merge runs of events whose intermediate states nobody needs to see:
+    consecutive moves keep the last position, consecutive wheel ticks at
+    one point add up, and consecutive text chunks join."""
+    merged = []
+    for event in events:
+        kind = event.get('type')
+        last = merged[-1] if merged else None
+        if last is not None and last['type'] == kind:
+            if kind == 'move':
+                merged[-1] = dict(event)
+                continue
+            if (kind == 'wheel' and last.get('x') == event.get('x')
+                    and last.get('y') == event.get('y')
+                    and modifier_mask(last) == modifier_mask(event)):
+                last['dx'] = last.get('dx', 0) + event.get('dx', 0)
+                last['dy'] = last.get('dy', 0) + event.get('dy', 0)
+                continue
+            if kind == 'text':
+                last['text'] = last.get('text', '') + event.get('text', '')
+                continue
+        merged.append(dict(event))
+    return merged
+
+
+def key_params(event, down):
+    definition = (keyDefinitions.get(event.get('code'))
+                  or keyDefinitions.get(event.get('key')) or {})
+    key = event.get('key') or definition.get('key', '')
+    modifiers = modifier_mask(event)
+    text = ''
+    if down and not modifiers & ~MODIFIERS['shift']:
+        text = definition.get('text', key if len(key) == 1 else '')
+    params = {
+        'type': ('keyDown' if text else 'rawKeyDown') if down else 'keyUp',
+        'key': key,
+        'code': event.get('code') or definition.get('code', ''),
+        'windowsVirtualKeyCode': definition.get('keyCode', 0),
+        'modifiers': modifiers,
+        'location': definition.get('location', 0),
+    }
+    if text:
+        params['text'] = params['unmodifiedText'] = text
+    return params
+
+
+def mouse_params(event, type, **extra):
+    params = {'type': type, 'x': event.get('x', 0), 'y': event.get('y', 0),
+              'modifiers': modifier_mask(event)}
+    params.update(extra)
+    return params
+
+
+async def dispatch(cdp, events):
+    """Send a batch of client input events to the page over CDP, in order.
+    Returns the number of CDP input commands issued."""
+    # reject the whole batch up front rather than half-applying it
+    for event in events:
+        if event.get('type') not in EVENT_TYPES:
+            raise ValueError(f'Unknown input event type {event.get("type")!r}')
+    sent = 0
+
+    async def send(method, params):
+        nonlocal sent
+        await cdp.send(method, params)
+        sent += 1
+
+    for event in coalesce(events):
+        kind = event.get('type')
+        if kind == 'click':
+            button = event.get('button', 'left')
+            count = event.get('count', 1)
+            await send('Input.dispatchMouseEvent', mouse_params(event, 'mouseMoved'))
+            await send('Input.dispatchMouseEvent', mouse_params(
+                event, 'mousePressed', button=button, clickCount=count))
+            await send('Input.dispatchMouseEvent', mouse_params(
+                event, 'mouseReleased', button=button, clickCount=count))
+        elif kind == 'move':
+            await send('Input.dispatchMouseEvent', mouse_params(event, 'mouseMoved'))
+        elif kind in ('mousedown', 'mouseup'):
+            type = 'mousePressed' if kind == 'mousedown' else 'mouseReleased'
+            await send('Input.dispatchMouseEvent', mouse_params(
+                event, type, button=event.get('button', 'left'), clickCount=1))
+        elif kind == 'wheel':
+            await send('Input.dispatchMouseEvent', mouse_params(
+                event, 'mouseWheel', deltaX=event.get('dx', 0),
+                deltaY=event.get('dy', 0)))
+        elif kind in ('keydown', 'keyup'):
+            await send('Input.dispatchKeyEvent',
+                       key_params(event, kind == 'keydown'))
+        elif kind == 'text' and event.get('text'):
+            await send('Input.insertText', {'text': event['text']})
+    return sent
+
+
+async def settle(cdp, timeout=SETTLE_TIMEOUT):
+    """Wait until the page has painted the effects of dispatched input
+    (two animation frames), or ``timeout`` seconds at most."""
+    try:
+        await asyncio.wait_for(cdp.send('Runtime.evaluate', {
+            'expression': SETTLE_SCRIPT, 'awaitPromise': True}), timeout)
+    except asyncio.TimeoutError:
+        pass
@@ -1,5 +1,29 @@
+import hashlib
+
 from selenium.webdriver import Chrome
 
+# 32-bit FNV-1a over a string, so snapshots can be compared in the page
+# without shipping every value back
+DIGEST_JS = \
+    "function digest(s) { " \
+    "  var h = 0x811c9dc5; " \
+    "  for (var i = 0; i < s.length; ++i) " \
+    "    h = Math.imul(h ^ s.charCodeAt(i), 0x01000193) >>> 0; " \
+    "  return h.toString(16); } "
+
+
+class Snapshot:
+
+    def __init__(self, items, digests):
+        self.items = items
+        self.digests = digests
+
+    @property
+    def version(self):
+        encoded = "\n".join(
+            f"{key}\t{self.digests[key]}" for key in sorted(self.digests))
+        return hashlib.blake2b(encoded.encode(), digest_size=8).hexdigest()
+
 
 class LocalStorage:
 
@@ -32,8 +56,50 @@ class LocalStorage:
             "localStorage.setItem(arguments[0], arguments[1]);", key,
             value)
 
+    def get_many(self, keys):
+        return self.driver.execute_script( \
+            "var items = {}; " \
+            "for (var i = 0; i < arguments[0].length; ++i) " \
+            "  items[arguments[0][i]] = localStorage.getItem(arguments[0][i]); " \
+            "return items; ", list(keys))
+
+    def set_many(self, items):
+        self.driver.execute_script( \
+            "for (var k in arguments[0]) " \
+            "  localStorage.setItem(k, arguments[0][k]); ", dict(items))
+
+    def update(self, items=(), **kwargs):
+        self.set_many(dict(items, **kwargs))
+
+    def snapshot(self):
+        result = self.driver.execute_script( \
+            DIGEST_JS + \
+            "var items = {}, digests = {}; " \
+            "for (var i = 0, k; i < localStorage.length; ++i) { " \
+            "  items[k = localStorage.key(i)] = localStorage.getItem(k); " \
+            "  digests[k] = digest(items[k]); } " \
+            "return [items, digests]; ")
+        return Snapshot(*result)
+
+    def diff_since(self, snapshot):
+        # returns (changed items, removed keys, new snapshot)
+        changed, removed, digests = self.driver.execute_script( \
+            DIGEST_JS + \
+            "var old = arguments[0], changed = {}, removed = [], digests = {}; " \
+            "for (var i = 0, k; i < localStorage.length; ++i) { " \
+            "  var v = localStorage.getItem(k = localStorage.key(i)); " \
+            "  digests[k] = digest(v); " \
+            "  if (old[k] !== digests[k]) changed[k] = v; } " \
+            "for (var k in old) if (!(k in digests)) removed.push(k); " \
+            "return [changed, removed, digests]; ", snapshot.digests)
+        items = {key: value for key, value in snapshot.items.items()
+                 if key not in removed}
+        items.update(changed)
+        return changed, removed, Snapshot(items, digests)
+
     def has(self, key):
-        return key in self.keys()
+        return self.driver.execute_script(
+            "return localStorage.getItem(arguments[0]) !== null;", key)
 
     def remove(self, key):
         self.driver.execute_script(
@@ -52,10 +118,10 @@ class LocalStorage:
         self.set(key, value)
 
     def __contains__(self, key):
-        return key in self.keys()
+        return self.has(key)
 
     def __iter__(self):
-        return self.items().__iter__()
+        return self.keys().__iter__()
 
     def __repr__(self):
         return self.items().__str__()
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+
+
+class LoopThread:
+    """A long-lived asyncio loop on its own thread.
+
+    Synchronous code (Flask handlers) submits coroutines with ``run()`` or
+    ``submit()``, so independent CDP operations can be in flight at once.
+    """
+
+    def __init__(self, name='browser-loop'):
+        self.name = name
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self._run, name=self.name,
+                                           daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        if threading.current_thread() is self.thread:
+            raise RuntimeError('LoopThread.run() called from the loop thread')
+        return self.submit(coro).result(timeout)
+
+    def call_soon(self, callback, *args):
+        self.start()
+        return self.loop.call_soon_threadsafe(callback, *args)
+
+    def stop(self):
+        with self._lock:
+            if self.thread is None:
+                return
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.thread = None
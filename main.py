@@ -4,17 +4,27 @@ from selenium.webdriver import Chrome, ChromeOptions
 from selenium.webdriver.common.by import By
 from urllib.parse import urlparse
 from time import sleep
-from replit import db
 
+from cookie_store import BLOB_KEY, CookieStore
 from localstorage import LocalStorage
+from storage import open_backend
 
 # change this to a website like discord.com to enable LocalStorage
 SINGLE_PAGE = ""
 LANDING_PAGE = "https://uulanding.vercel.app/"
+# "replit" for the Replit database, or a local path like "uc2.sqlite3" or
+# "uc2.json" to run outside of Replit
+STORAGE = "replit"
+
+LOCALSTORAGE_KEY = "localstorage"
+
+db = open_backend(STORAGE)
+cookie_store = CookieStore(db)
+ls_snapshot = None
 
 
 def is_cookies() -> None:
-    return len([key for key in db.keys() if key.isnumeric()]) > 0
+    return cookie_store.exists()
 
 
 def assemble_url(cookie: dict) -> str:
@@ -28,44 +38,75 @@ def assemble_url(cookie: dict) -> str:
     return url
 
 
+def get_all_cookies(driver: Chrome) -> list[dict]:
+    # unlike get_cookies(), this covers every domain, not just the current one
+    try:
+        return driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+    except Exception:
+        return driver.get_cookies()
+
+
+def set_cookies(driver: Chrome, cookies: list[dict]) -> None:
+    try:
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+    except Exception:
+        for cookie in cookies:
+            cookie = dict(cookie)
+            if "expires" in cookie:
+                cookie["expiry"] = int(cookie.pop("expires"))
+            driver.add_cookie(cookie)
+
+
 def save_cookies(driver: Chrome) -> None:
     print("Saving cookies...", end="")
     try:
-        for key in [key for key in db.keys() if key.isnumeric()]:
-            del db[key]
-        for index, value in enumerate(driver.get_cookies()):
-            db[str(index)] = value
+        changes = cookie_store.save(get_all_cookies(driver))
     except Exception:
         print("fail")
     else:
-        print("done")
+        if changes is None:
+            print("unchanged")
+        else:
+            added, changed, removed = changes
+            print(f"done (+{len(added)} ~{len(changed)} -{len(removed)})")
 
 
 def load_cookies(driver: Chrome) -> None:
     print("Loading cookies...", end="")
     try:
-        for key in sorted([key for key in db.keys() if key.isnumeric()],
-                          key=lambda key: int(key)):
-            cookie: dict = db[key]
-            # url = assemble_url(cookie)
-            # if urlparse(driver.current_url).hostname != urlparse(url).hostname:
-            #     driver.get(url)
-            driver.add_cookie(dict(cookie))
+        set_cookies(driver, cookie_store.load())
     except Exception:
         print("fail")
     else:
         print("done")
 
 
+def legacy_localstorage_keys() -> list[str]:
+    # v1 stored one LocalStorage item per alphabetic key
+    return [key for key in db.keys()
+            if key.isalpha() and key not in (BLOB_KEY, LOCALSTORAGE_KEY)]
+
+
 def is_localstorage() -> None:
-    return len([key for key in db.keys() if key.isalpha()]) > 0
+    return LOCALSTORAGE_KEY in db or len(legacy_localstorage_keys()) > 0
 
 
 def save_localstorage(ls: LocalStorage) -> None:
+    global ls_snapshot
     print("Saving LocalStorage...", end="")
     try:
-        for key, value in ls.items():
-            db[key] = value
+        if ls_snapshot is None:
+            snapshot = ls.snapshot()
+        else:
+            changed, removed, snapshot = ls.diff_since(ls_snapshot)
+            if not changed and not removed:
+                print("unchanged")
+                return
+        db[LOCALSTORAGE_KEY] = {"version": snapshot.version,
+                                "items": snapshot.items}
+        for key in legacy_localstorage_keys():
+            del db[key]
+        ls_snapshot = snapshot
     except Exception:
         print("fail")
     else:
@@ -73,11 +114,17 @@ def save_localstorage(ls: LocalStorage) -> None:
 
 
 def load_localstorage(ls: LocalStorage) -> None:
+    global ls_snapshot
     print("Loading LocalStorage...", end="")
     assert SINGLE_PAGE
     try:
-        for key, value in [key for key in db.keys() if key.isalpha()]:
-            ls[key] = value
+        blob = db.get(LOCALSTORAGE_KEY)
+        if blob is not None:
+            items = dict(blob["items"])
+        else:
+            items = {key: db[key] for key in legacy_localstorage_keys()}
+        ls.set_many(items)
+        ls_snapshot = ls.snapshot()
     except Exception:
         print("fail")
     else:
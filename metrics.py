@@ -0,0 +1,205 @@
+"""Process-wide metrics rendered in the Prometheus text exposition format.
+
+Kept dependency-free: histograms and counters are plain locked dicts keyed
+by label values, and gauges are callbacks evaluated at scrape time.
+"""
+import math
+import os
+import threading
+
+# seconds; covers sub-millisecond CDP round trips up to slow page loads
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0, 30.0)
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f'{self.name}_total{format_labels(self.labels, key)} {format_value(value)}'
+                for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            values = {key: (list(counts), total, count)
+                      for key, (counts, total, count) in self._values.items()}
+        lines = []
+        for key, (counts, total, count) in sorted(values.items()):
+            for bound, bucket in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket'
+                             f'{format_labels(self.labels, key, [("le", format_value(bound))])}'
+                             f' {bucket}')
+            lines.append(f'{self.name}_bucket'
+                         f'{format_labels(self.labels, key, [("le", "+Inf")])} {count}')
+            lines.append(f'{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}')
+            lines.append(f'{self.name}_count{format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Gauge(Metric):
+    """A value read from ``callback`` at scrape time. The callback returns
+    a number, or a dict of label-value tuples to numbers."""
+    type = 'gauge'
+
+    def __init__(self, name, help, callback, labels=()):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def _samples(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        if value is None:
+            return []
+        if not isinstance(value, dict):
+            value = {(): value}
+        return [f'{self.name}{format_labels(self.labels, key)} {format_value(sample)}'
+                for key, sample in sorted(value.items())]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, callback, labels=()):
+        return self.register(Gauge(name, help, callback, labels))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram(
+    'uc_stage_seconds', 'Time spent in each stage of serving a request.', ['stage'])
+LOCK_WAIT_SECONDS = registry.histogram(
+    'uc_session_lock_wait_seconds', 'Time spent waiting for a session lock.')
+CAPTURE_SECONDS = registry.histogram(
+    'uc_capture_seconds', 'CDP Page.captureScreenshot round trips.', ['format'])
+NAVIGATION_SECONDS = registry.histogram(
+    'uc_navigation_seconds', 'Time from navigation start to each lifecycle phase.',
+    ['phase'], buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 8.0, 12.0, 15.0, 30.0))
+FRAME_REQUESTS = registry.counter(
+    'uc_frame_requests', 'Frame requests by whether a shared frame was reused.', ['result'])
+TILE_REQUESTS = registry.counter(
+    'uc_tile_requests', 'Page tile requests by whether a cached tile was reused.', ['result'])
+
+
+def frame_hit_ratio():
+    hits, misses = FRAME_REQUESTS.value(result='hit'), FRAME_REQUESTS.value(result='miss')
+    return hits / (hits + misses) if hits + misses else None
+
+
+registry.gauge('uc_frame_cache_hit_ratio',
+               'Share of frame requests served from a shared frame.', frame_hit_ratio)
+
+
+def rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def process_tree(pid):
+    """``pid`` and all its descendants, read from /proc."""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as file:
+                parent = int(file.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+    found, stack = [pid], [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
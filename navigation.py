@@ -0,0 +1,166 @@
+import asyncio
+import time
+import uuid
+
+from metrics import NAVIGATION_SECONDS
+
+NAVIGATION_TIMEOUT = 15.0
+# lifecycle events reported to clients, in the order pages usually reach them
+MILESTONES = {
+    'DOMContentLoaded': 'domcontentloaded',
+    'firstPaint': 'firstpaint',
+    'firstContentfulPaint': 'firstcontentfulpaint',
+    'load': 'load',
+    'networkIdle': 'networkidle',
+}
+# milestones after which frames of the new page are worth capturing
+PAINTED = ('firstpaint', 'firstcontentfulpaint', 'load')
+FINAL_STATES = ('complete', 'failed', 'timeout', 'superseded')
+JOB_HISTORY = 8
+# phases worth a histogram; the other end states say nothing about speed
+TIMED_PHASES = ('committed', *MILESTONES.values(), 'complete')
+
+
+class NavigationJob:
+    """One navigation of a session's page, followed through its CDP
+    lifecycle events: ``committed``, ``domcontentloaded``, ``firstpaint``,
+    ``load`` and ``networkidle``. The job is complete at network idle, or at
+    the timeout if the page has loaded by then; otherwise it ends on failure,
+    on timeout or when a newer navigation replaces it."""
+
+    def __init__(self, url, timeout=NAVIGATION_TIMEOUT):
+        self.id = uuid.uuid4().hex[:12]
+        self.url = url
+        self.timeout = timeout
+        self.state = 'pending'
+        self.error = None
+        self.events = []
+        self.started = time.monotonic()
+        self.frame_id = None
+        self.loader_id = None
+        self._changed = asyncio.Event()
+
+    @property
+    def done(self):
+        return self.state in FINAL_STATES
+
+    def record(self, name, state=None):
+        if any(event['name'] == name for event in self.events):
+            return False
+        elapsed = time.monotonic() - self.started
+        self.events.append({'name': name, 'ms': round(elapsed * 1000)})
+        if name in TIMED_PHASES:
+            NAVIGATION_SECONDS.observe(elapsed, phase=name)
+        if state is not None:
+            self.state = state
+        self._changed.set()
+        self._changed = asyncio.Event()
+        return True
+
+    def finish(self, state, error=None):
+        if self.done:
+            return
+        self.state = state
+        self.error = error
+        self.record(state)
+
+    async def wait(self, after=0, timeout=None):
+        """Wait until the job has more than ``after`` events or is done."""
+        if len(self.events) <= after and not self.done:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self
+
+    def to_dict(self, after=0):
+        return {'job': self.id, 'url': self.url, 'state': self.state,
+                'error': self.error, 'done': self.done,
+                'events': self.events[after:], 'seq': len(self.events)}
+
+
+class Navigator:
+    """Runs a session's navigations as background jobs on the browser loop,
+    so requests return at once and viewers see the page from first paint
+    instead of waiting for ``load``."""
+
+    def __init__(self, cdp, on_paint=None, timeout=NAVIGATION_TIMEOUT):
+        self.cdp = cdp
+        self.on_paint = on_paint
+        self.timeout = timeout
+        self.jobs = {}
+        self.current = None
+        # lifecycle events can beat the Page.navigate reply that says which
+        # frame and loader they belong to
+        self._early = []
+        cdp.on('Page.lifecycleEvent', self._on_lifecycle)
+
+    def start(self, url):
+        if self.current is not None:
+            self.current.finish('superseded')
+        job = self.current = NavigationJob(url, self.timeout)
+        self._early = []
+        self.jobs[job.id] = job
+        while len(self.jobs) > JOB_HISTORY:
+            del self.jobs[next(iter(self.jobs))]
+        asyncio.ensure_future(self._run(job))
+        return job
+
+    async def _run(self, job):
+        job.state = 'navigating'
+        try:
+            result = await asyncio.wait_for(
+                self.cdp.send('Page.navigate', {'url': job.url}), job.timeout)
+        except asyncio.TimeoutError:
+            job.finish('timeout', 'Navigation did not commit in time')
+            return
+        except Exception as e:
+            job.finish('failed', str(e))
+            return
+        if result.get('errorText'):
+            job.finish('failed', result['errorText'])
+            return
+        if job.done:
+            return
+        job.frame_id = result.get('frameId')
+        job.loader_id = result.get('loaderId')
+        job.record('committed', 'committed')
+        # same-document navigations have no loader and no lifecycle events
+        if job.loader_id is None:
+            job.finish('complete')
+            self._painted()
+            return
+        early, self._early = self._early, []
+        for event in early:
+            self._on_lifecycle(event)
+        remaining = job.timeout - (time.monotonic() - job.started)
+        while not job.done and remaining > 0:
+            await job.wait(len(job.events), remaining)
+            remaining = job.timeout - (time.monotonic() - job.started)
+        if not job.done:
+            job.finish('complete' if job.state == 'loaded' else 'timeout')
+
+    def _on_lifecycle(self, event):
+        job = self.current
+        if job is None or job.done:
+            return
+        if job.frame_id is None:
+            self._early.append(event)
+            return
+        if event.get('frameId') != job.frame_id:
+            return
+        if job.loader_id and event.get('loaderId') != job.loader_id:
+            return
+        name = MILESTONES.get(event.get('name'))
+        if name is None:
+            return
+        if not job.record(name, 'loaded' if name == 'load' else None):
+            return
+        if name in PAINTED:
+            self._painted()
+        if name == 'networkidle':
+            job.finish('complete')
+
+    def _painted(self):
+        if self.on_paint is not None:
+            self.on_paint()
@@ -0,0 +1,113 @@
+import os
+import threading
+
+MIN_QUALITY = int(os.environ.get('MIN_QUALITY', 30))
+MAX_QUALITY = int(os.environ.get('MAX_QUALITY', 85))
+MIN_FPS = float(os.environ.get('MIN_FPS', 1))
+MAX_FPS = float(os.environ.get('MAX_FPS', 15))
+MIN_SCALE = float(os.environ.get('MIN_SCALE', 0.25))
+# the share of measured client throughput we allow frames to use
+BANDWIDTH_SHARE = 0.7
+# rough JPEG bytes per pixel at quality 70, refined from observed frames
+DEFAULT_BYTES_PER_PIXEL = 0.12
+QUALITY_STEP = 5
+SCALE_STEP = 0.8
+# below this many frames per second we trade quality and size for smoothness
+TARGET_FPS = 5
+
+
+def relative_size(quality):
+    # empirical shape of JPEG/WebP size against quality, normalised to q70
+    return (0.3 + (quality / 100) ** 2 * 1.4) / (0.3 + 0.49 * 1.4)
+
+
+class QualityController:
+    """Picks capture scale, format, quality and frame rate for one session
+    from what the client reports about its display and connection."""
+
+    def __init__(self, viewport, min_quality=MIN_QUALITY,
+                 max_quality=MAX_QUALITY, min_fps=MIN_FPS, max_fps=MAX_FPS,
+                 min_scale=MIN_SCALE):
+        self.viewport = viewport
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_fps = min_fps
+        self.max_fps = max_fps
+        self.min_scale = min_scale
+        self.display = None
+        self.throughput = None
+        self.rtt = None
+        self.webp = False
+        self.bytes_per_pixel = DEFAULT_BYTES_PER_PIXEL
+        self._lock = threading.Lock()
+        self._settings = self._compute()
+
+    def report(self, width=None, height=None, dpr=1.0, throughput=None,
+               rtt=None, webp=False):
+        """Update from a client report. ``throughput`` is in bytes per
+        second and ``rtt`` in milliseconds. Returns the new settings."""
+        with self._lock:
+            if width and height:
+                self.display = (width * (dpr or 1.0), height * (dpr or 1.0))
+            if throughput:
+                self.throughput = float(throughput)
+            if rtt:
+                self.rtt = float(rtt)
+            self.webp = bool(webp)
+            self._settings = self._compute()
+            return dict(self._settings)
+
+    def observe(self, size, width, height, quality):
+        """Feed back the size of an encoded frame to refine estimates."""
+        if not size or not width or not height:
+            return
+        with self._lock:
+            measured = size / (width * height) / relative_size(quality)
+            self.bytes_per_pixel = 0.8 * self.bytes_per_pixel + 0.2 * measured
+
+    @property
+    def settings(self):
+        with self._lock:
+            return dict(self._settings)
+
+    def _compute(self):
+        full_width, full_height = self.viewport['width'], self.viewport['height']
+        scale = 1.0
+        if self.display:
+            scale = min(1.0, self.display[0] / full_width,
+                        self.display[1] / full_height)
+        scale = max(self.min_scale, scale)
+        format = 'webp' if self.webp else 'jpeg'
+        quality = self.max_quality
+        fps = self.max_fps
+
+        if self.throughput:
+            budget = self.throughput * BANDWIDTH_SHARE
+            target_fps = min(TARGET_FPS, self.max_fps)
+
+            def frame_size():
+                pixels = full_width * full_height * scale * scale
+                return pixels * self.bytes_per_pixel * relative_size(quality)
+
+            while budget / frame_size() < target_fps:
+                if quality - QUALITY_STEP >= self.min_quality:
+                    quality -= QUALITY_STEP
+                elif scale * SCALE_STEP >= self.min_scale:
+                    scale *= SCALE_STEP
+                else:
+                    break
+            fps = budget / frame_size()
+
+        if self.rtt:
+            # with one frame in flight per client, frames cannot outpace acks
+            fps = min(fps, 1000 / self.rtt)
+        fps = max(self.min_fps, min(self.max_fps, fps))
+
+        return {
+            'scale': round(scale, 3),
+            'width': int(full_width * scale),
+            'height': int(full_height * scale),
+            'format': format,
+            'quality': quality,
+            'fps': round(fps, 2),
+        }
@@ -0,0 +1,262 @@
+import asyncio
+import base64
+import email.utils
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+CACHE_DIR = os.environ.get('RESOURCE_CACHE_DIR', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.resource-cache'))
+CACHE_MAX_BYTES = int(float(os.environ.get('RESOURCE_CACHE_MAX_MB', 512)) * 1024 * 1024)
+CACHEABLE_TYPES = ('Script', 'Stylesheet', 'Font', 'Image')
+# headers that describe the stored body rather than the original transfer
+DROPPED_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding',
+                   'set-cookie', 'connection')
+
+TRACKER_HOSTS = (
+    'google-analytics.com', 'googletagmanager.com', 'scorecardresearch.com',
+    'hotjar.com', 'segment.io', 'segment.com', 'mixpanel.com',
+    'quantserve.com', 'newrelic.com', 'nr-data.net', 'fullstory.com',
+    'connect.facebook.net', 'bat.bing.com', 'clarity.ms',
+)
+AD_HOSTS = (
+    'doubleclick.net', 'googlesyndication.com', 'googleadservices.com',
+    'adservice.google.com', 'adnxs.com', 'amazon-adsystem.com',
+    'taboola.com', 'outbrain.com', 'criteo.com', 'criteo.net',
+    'pubmatic.com', 'rubiconproject.com', 'openx.net', 'moatads.com',
+)
+# resource classes a session can block
+BLOCK_CLASSES = {
+    'trackers': lambda event: host_matches(event, TRACKER_HOSTS),
+    'ads': lambda event: host_matches(event, AD_HOSTS),
+    'media': lambda event: event.get('resourceType') == 'Media',
+    'fonts': lambda event: event.get('resourceType') == 'Font',
+    'images': lambda event: event.get('resourceType') == 'Image',
+}
+
+
+def host_matches(event, hosts):
+    host = urlsplit(event['request']['url']).hostname or ''
+    return any(host == suffix or host.endswith('.' + suffix) for suffix in hosts)
+
+
+def parse_policy(spec):
+    """Turn ``"ads,trackers"`` into a set of known block classes."""
+    classes = {name.strip() for name in (spec or '').split(',') if name.strip()}
+    unknown = classes - set(BLOCK_CLASSES)
+    if unknown:
+        raise ValueError(f'Unknown resource classes: {", ".join(sorted(unknown))}')
+    return classes
+
+
+def freshness(headers, now=None):
+    """Return until when a response may be reused by a shared cache, or
+    None if it must not be stored."""
+    now = now or time.time()
+    cache_control = headers.get('cache-control', '').lower()
+    if re.search(r'\b(no-store|no-cache|private)\b', cache_control):
+        return None
+    vary = headers.get('vary', '').lower().replace(' ', '')
+    if vary and vary != 'accept-encoding':
+        return None
+    match = (re.search(r'\bs-maxage=(\d+)', cache_control)
+             or re.search(r'\bmax-age=(\d+)', cache_control))
+    if match:
+        lifetime = int(match.group(1))
+        return now + lifetime if lifetime > 0 else None
+    if 'expires' in headers:
+        try:
+            expires = email.utils.parsedate_to_datetime(headers['expires']).timestamp()
+        except (TypeError, ValueError):
+            return None
+        return expires if expires > now else None
+    return None
+
+
+class DiskCache:
+    """Shared content-addressed response cache with size-bounded LRU
+    eviction. Bodies live under ``objects/`` named by their SHA-256, so
+    identical assets served from different URLs are stored once."""
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite3'),
+                                   check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS entries (url TEXT PRIMARY KEY, '
+                'digest TEXT NOT NULL, status INTEGER NOT NULL, '
+                'headers TEXT NOT NULL, size INTEGER NOT NULL, '
+                'expires REAL NOT NULL, last_used REAL NOT NULL)')
+
+    def _path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def get(self, url):
+        """Return ``(status, headers, body)`` for a fresh entry, or None."""
+        with self._lock:
+            row = self._db.execute(
+                'SELECT digest, status, headers, expires FROM entries '
+                'WHERE url = ?', (url,)).fetchone()
+            if row is None or row[3] < time.time():
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(row[0]), 'rb') as file:
+                    body = file.read()
+            except FileNotFoundError:
+                self._db.execute('DELETE FROM entries WHERE url = ?', (url,))
+                self.misses += 1
+                return None
+            with self._db:
+                self._db.execute('UPDATE entries SET last_used = ? WHERE url = ?',
+                                 (time.time(), url))
+            self.hits += 1
+            return row[1], json.loads(row[2]), body
+
+    def put(self, url, status, headers, body, expires):
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._path(digest)
+        with self._lock:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temporary = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(temporary, 'wb') as file:
+                    file.write(body)
+                os.replace(temporary, path)
+            with self._db:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (url, digest, status, json.dumps(headers), len(body), expires,
+                     time.time()))
+            self._evict()
+
+    def _evict(self):
+        # objects are shared between URLs, so count each digest once
+        total = self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size '
+            'FROM entries)').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            'SELECT url, digest FROM entries ORDER BY last_used').fetchall()
+        with self._db:
+            for url, digest in rows:
+                self._db.execute('DELETE FROM entries WHERE url = ?', (url,))
+                if self._db.execute('SELECT 1 FROM entries WHERE digest = ?',
+                                    (digest,)).fetchone():
+                    continue
+                try:
+                    size = os.path.getsize(self._path(digest))
+                    os.remove(self._path(digest))
+                except FileNotFoundError:
+                    size = 0
+                total -= size
+                if total <= self.max_bytes:
+                    break
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._db.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries, 'bytes': size}
+
+
+class RequestInterceptor:
+    """Intercepts a page's requests through the CDP Fetch domain to block
+    configured resource classes and to serve cacheable static assets from a
+    shared ``DiskCache``."""
+
+    def __init__(self, cache=None, blocked=()):
+        self.cache = cache
+        self.blocked = set(blocked)
+        self.counts = {'blocked': 0, 'hits': 0, 'misses': 0, 'stored': 0}
+        self.cdp = None
+
+    async def attach(self, cdp):
+        self.cdp = cdp
+        cdp.on('Fetch.requestPaused',
+               lambda event: asyncio.ensure_future(self._on_paused(event)))
+        patterns = [{'urlPattern': '*', 'requestStage': 'Request'}]
+        if self.cache is not None:
+            patterns += [{'urlPattern': '*', 'resourceType': type,
+                          'requestStage': 'Response'} for type in CACHEABLE_TYPES]
+        await cdp.send('Fetch.enable', {'patterns': patterns})
+
+    def stats(self):
+        lookups = self.counts['hits'] + self.counts['misses']
+        return dict(self.counts, blocked_classes=sorted(self.blocked),
+                    hit_rate=self.counts['hits'] / lookups if lookups else 0.0)
+
+    def _cacheable(self, event):
+        return (self.cache is not None
+                and event['request']['method'] == 'GET'
+                and event.get('resourceType') in CACHEABLE_TYPES
+                and event['request']['url'].startswith(('http://', 'https://')))
+
+    async def _on_paused(self, event):
+        request_id = event['requestId']
+        try:
+            if 'responseStatusCode' in event:
+                await self._store(event)
+            elif any(BLOCK_CLASSES[name](event) for name in self.blocked):
+                self.counts['blocked'] += 1
+                await self.cdp.send('Fetch.failRequest', {
+                    'requestId': request_id, 'errorReason': 'BlockedByClient'})
+                return
+            elif self._cacheable(event):
+                loop = asyncio.get_event_loop()
+                cached = await loop.run_in_executor(
+                    None, self.cache.get, event['request']['url'])
+                if cached is not None:
+                    status, headers, body = cached
+                    self.counts['hits'] += 1
+                    await self.cdp.send('Fetch.fulfillRequest', {
+                        'requestId': request_id,
+                        'responseCode': status,
+                        'responseHeaders': [{'name': name, 'value': value}
+                                            for name, value in headers.items()],
+                        'body': base64.b64encode(body).decode(),
+                    })
+                    return
+                self.counts['misses'] += 1
+            await self.cdp.send('Fetch.continueRequest', {'requestId': request_id})
+        except Exception as e:
+            print(f"Interception error: {e}", file=sys.stderr, flush=True)
+            try:
+                await self.cdp.send('Fetch.continueRequest', {'requestId': request_id})
+            except Exception:
+                pass
+
+    async def _store(self, event):
+        if event['responseStatusCode'] != 200 or not self._cacheable(event):
+            return
+        headers = {header['name'].lower(): header['value']
+                   for header in event.get('responseHeaders', [])}
+        expires = freshness(headers)
+        if expires is None or 'set-cookie' in headers:
+            return
+        result = await self.cdp.send('Fetch.getResponseBody',
+                                     {'requestId': event['requestId']})
+        body = result['body']
+        body = base64.b64decode(body) if result.get('base64Encoded') else body.encode()
+        headers = {name: value for name, value in headers.items()
+                   if name not in DROPPED_HEADERS}
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self.cache.put, event['request']['url'],
+                                   200, headers, body, expires)
+        self.counts['stored'] += 1
@@ -0,0 +1,387 @@
+"""Front router for running several ``browser_app`` workers.
+
+Each worker is its own process with its own Chromium and session pool. The
+router pins every session to one worker: new sessions are placed on a
+consistent-hash ring of healthy workers, and a session stays on its worker
+for as long as that worker is healthy. When a worker dies only its own
+sessions move, and the worker is restarted with backoff.
+"""
+import bisect
+import hashlib
+import http.client
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+from flask import Flask, Response, request
+
+from config import SESSION_COOKIE, SESSION_IDLE_TIMEOUT
+from server import SHORT_POLL_TIMEOUT, long_requests, serve
+from snapshots import SESSION_STORE, SNAPSHOT_MAX_AGE
+
+WORKERS = int(os.environ.get('WORKERS', os.cpu_count() or 1))
+PORT = int(os.environ.get('PORT', 5000))
+WORKER_BASE_PORT = int(os.environ.get('WORKER_BASE_PORT', PORT + 1))
+VIRTUAL_NODES = 64
+HEALTH_INTERVAL = 2.0
+# consecutive failed health checks before a live process counts as down
+HEALTH_FAILURES = 3
+PROXY_TIMEOUT = 60
+# idle keep-alive connections kept open to each worker
+POOL_SIZE = 16
+# headers that describe one hop rather than the message
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate',
+               'proxy-authorization', 'te', 'trailers', 'transfer-encoding',
+               'upgrade'}
+# recomputed for the upstream request
+REQUEST_HEADERS_SKIPPED = HOP_HEADERS | {'host', 'content-length', 'cookie'}
+
+app = Flask(__name__, static_folder=None)
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes, so removing a node only
+    moves the keys that node owned."""
+
+    def __init__(self, nodes=(), replicas=VIRTUAL_NODES):
+        self.replicas = replicas
+        self._points = []
+        self._owners = {}
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(set(self._owners.values()))
+
+    def add(self, node):
+        for replica in range(self.replicas):
+            point = ring_hash(f'{node}#{replica}')
+            if point not in self._owners:
+                bisect.insort(self._points, point)
+            self._owners[point] = node
+
+    def remove(self, node):
+        for replica in range(self.replicas):
+            point = ring_hash(f'{node}#{replica}')
+            if self._owners.get(point) == node:
+                del self._owners[point]
+                self._points.remove(point)
+
+    def lookup(self, key):
+        if not self._points:
+            return None
+        index = bisect.bisect(self._points, ring_hash(key)) % len(self._points)
+        return self._owners[self._points[index]]
+
+
+class Worker:
+    """One ``browser_app`` process on its own port and Chromium profile."""
+
+    def __init__(self, index, port):
+        self.index = index
+        self.port = port
+        self.name = f'worker-{index}'
+        self.process = None
+        self.healthy = False
+        self.failures = 0
+        self.restarts = 0
+        self.next_start = 0
+        self.info = {}
+        self._idle = []
+        self._idle_lock = threading.Lock()
+
+    def start(self):
+        base = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, PORT=str(self.port),
+                   USER_DATA_DIR=os.path.join(
+                       os.environ.get('USER_DATA_DIR', os.path.join(base, '.chrome-profile')),
+                       self.name))
+        # its own process group, so its Chromium can be killed along with it
+        self.process = subprocess.Popen([sys.executable, os.path.join(base, 'browser_app.py')],
+                                        env=env, start_new_session=True)
+        self.failures = 0
+        print(f"Started {self.name} (pid {self.process.pid}) on port {self.port}",
+              file=sys.stderr, flush=True)
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def connect(self, timeout=PROXY_TIMEOUT):
+        return http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+
+    def acquire(self):
+        """A kept-alive connection to this worker, and whether it is reused."""
+        with self._idle_lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.connect(), False
+
+    def release(self, connection):
+        with self._idle_lock:
+            if len(self._idle) < POOL_SIZE:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def close_idle(self):
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+    def check(self):
+        connection = self.connect(timeout=HEALTH_INTERVAL)
+        try:
+            connection.request('GET', '/api/health')
+            response = connection.getresponse()
+            body = response.read()
+            if response.status != 200:
+                return False
+            self.info = json.loads(body)
+            return True
+        except (OSError, ValueError, http.client.HTTPException):
+            return False
+        finally:
+            connection.close()
+
+    def stop(self):
+        if self.alive():
+            # the worker saves its sessions and closes its Chromium on SIGTERM
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                pass
+        self.kill()
+
+    def kill(self):
+        """Kill the worker's whole process group, so no Chromium it started
+        outlives it and holds on to its profile."""
+        if self.process is None:
+            return
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+
+
+class Router:
+    def __init__(self, workers, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.workers = {worker.name: worker for worker in workers}
+        self.idle_timeout = idle_timeout
+        self.ring = HashRing()
+        self.assignments = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+        threading.Thread(target=self._supervise, name='router-health', daemon=True).start()
+
+    def route(self, session_id):
+        """The worker that owns ``session_id``, placing it if needed."""
+        with self._lock:
+            now = time.monotonic()
+            assigned = self.assignments.get(session_id)
+            if assigned is not None and self.workers[assigned[0]].healthy:
+                name = assigned[0]
+            else:
+                name = self.ring.lookup(session_id)
+                if name is None:
+                    return None
+            self.assignments[session_id] = (name, now)
+            return self.workers[name]
+
+    def mark_down(self, worker, reason):
+        with self._lock:
+            if not worker.healthy:
+                return
+            worker.healthy = False
+            worker.close_idle()
+            self.ring.remove(worker.name)
+            # its sessions are gone with its browser; let the ring re-place them
+            moved = [session_id for session_id, (name, _) in self.assignments.items()
+                     if name == worker.name]
+            for session_id in moved:
+                del self.assignments[session_id]
+        print(f"{worker.name} down ({reason}); {len(moved)} sessions will be re-placed",
+              file=sys.stderr, flush=True)
+
+    def mark_up(self, worker):
+        with self._lock:
+            if worker.healthy:
+                return
+            worker.healthy = True
+            worker.failures = 0
+            worker.restarts = 0
+            self.ring.add(worker.name)
+        print(f"{worker.name} healthy", file=sys.stderr, flush=True)
+
+    def _supervise(self):
+        while not self._stopped.wait(HEALTH_INTERVAL):
+            for worker in list(self.workers.values()):
+                if not worker.alive():
+                    self.mark_down(worker, f'exited with {worker.process.returncode}')
+                    if time.monotonic() >= worker.next_start:
+                        worker.restarts += 1
+                        worker.next_start = time.monotonic() + min(2 ** worker.restarts, 60)
+                        # a worker that crashed can leave its Chromium behind
+                        worker.kill()
+                        worker.start()
+                    continue
+                if worker.check():
+                    self.mark_up(worker)
+                else:
+                    worker.failures += 1
+                    if worker.failures >= HEALTH_FAILURES:
+                        self.mark_down(worker, 'failing health checks')
+                    if worker.failures >= 2 * HEALTH_FAILURES:
+                        # hung rather than slow: restart it on the next pass
+                        worker.kill()
+            self._prune()
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            for session_id, (_, seen) in list(self.assignments.items()):
+                if seen < cutoff:
+                    del self.assignments[session_id]
+
+    def status(self):
+        with self._lock:
+            counts = {}
+            for name, _ in self.assignments.values():
+                counts[name] = counts.get(name, 0) + 1
+            return {name: {'port': worker.port, 'healthy': worker.healthy,
+                           'pid': worker.process.pid if worker.process else None,
+                           'restarts': worker.restarts,
+                           'sessions': counts.get(name, 0), 'info': worker.info}
+                    for name, worker in self.workers.items()}
+
+    def stop(self):
+        self._stopped.set()
+        for worker in self.workers.values():
+            worker.stop()
+
+
+router = Router([Worker(index, WORKER_BASE_PORT + index) for index in range(WORKERS)])
+
+
+@app.route('/router/status')
+def router_status():
+    return router.status()
+
+
+@app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'OPTIONS'])
+@app.route('/<path:path>', methods=['GET', 'POST', 'OPTIONS'])
+def proxy(path):
+    session_id = request.cookies.get(SESSION_COOKIE)
+    new_session = not session_id
+    if new_session:
+        session_id = uuid.uuid4().hex
+    body = request.get_data()
+    headers = {name: value for name, value in request.headers.items()
+               if name.lower() not in REQUEST_HEADERS_SKIPPED}
+    cookies = [f'{name}={value}' for name, value in request.cookies.items()
+               if name != SESSION_COOKIE]
+    headers['Cookie'] = '; '.join(cookies + [f'{SESSION_COOKIE}={session_id}'])
+    headers['X-Forwarded-For'] = request.remote_addr or ''
+
+    path = request.full_path if request.query_string else request.path
+    # streams and long polls hold a router thread as long as a worker one,
+    # so they take the same slots here as on the workers
+    slot = False
+    if request.path == '/api/stream' or 'after' in request.args:
+        slot = long_requests.acquire(blocking=False)
+        if not slot:
+            if request.path == '/api/stream':
+                # clients fall back to polling
+                return {'error': 'Too many streams'}, 503, {'Retry-After': '30'}
+            args = request.args.copy()
+            args['timeout'] = SHORT_POLL_TIMEOUT
+            path = request.path + '?' + urlencode(list(args.items(multi=True)))
+    try:
+        response = forward(path, session_id, body, headers)
+    except BaseException:
+        if slot:
+            long_requests.release()
+        raise
+    if slot:
+        # runs even if the response is closed before it starts
+        response.call_on_close(long_requests.release)
+    if new_session:
+        # as the workers do: outlive the browser session when sessions are saved
+        response.set_cookie(SESSION_COOKIE, session_id, httponly=True, samesite='Lax',
+                            max_age=SNAPSHOT_MAX_AGE if SESSION_STORE else None)
+    return response
+
+
+def forward(path, session_id, body, headers):
+    """Send the request to the worker that owns ``session_id`` and relay
+    its response as it arrives."""
+    upstream = None
+    # a stale kept-alive connection is retried on a fresh one; a worker that
+    # fails on a fresh connection (refused, reset, timed out or answering
+    # garbage) is down and its sessions move once
+    for _ in range(3):
+        worker = router.route(session_id)
+        if worker is None:
+            break
+        connection, reused = worker.acquire()
+        try:
+            connection.request(request.method, path, body=body, headers=headers)
+            upstream = connection.getresponse()
+            break
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            if not reused:
+                router.mark_down(worker, repr(e))
+    if upstream is None:
+        return Response(json.dumps({'error': 'No healthy workers'}), status=503,
+                        mimetype='application/json')
+
+    def relay():
+        complete = False
+        try:
+            while True:
+                chunk = upstream.read1(65536)
+                if not chunk:
+                    break
+                yield chunk
+            complete = True
+        except (OSError, http.client.HTTPException) as e:
+            # the worker went away mid-response; end the client's too
+            print(f"{worker.name} dropped {path}: {e!r}", file=sys.stderr, flush=True)
+        finally:
+            # only a fully read response leaves the connection reusable
+            if complete and not upstream.will_close:
+                upstream.close()
+                worker.release(connection)
+            else:
+                connection.close()
+
+    response = Response(relay(), status=upstream.status,
+                        headers=[(name, value) for name, value in upstream.getheaders()
+                                 if name.lower() not in HOP_HEADERS])
+    response.headers['X-Worker'] = worker.name
+    return response
+
+
+if __name__ == '__main__':
+    router.start()
+    try:
+        serve(app, PORT)
+    finally:
+        router.stop()
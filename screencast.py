@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+ACK_TIMEOUT = 2.0
+
+
+class _Client:
+
+    def __init__(self):
+        self.sent = 0
+        self.sent_at = 0.0
+        self.acked = 0
+
+
+class Screencaster:
+    """Pushes frames painted by Chrome (``Page.startScreencast``) to clients.
+
+    Each client only gets a new frame once it has acked the previous one, so
+    slow clients skip straight to the latest frame instead of queuing.
+    """
+
+    def __init__(self, page, format='jpeg', quality=70, max_width=1280,
+                 max_height=720, fps=None, on_frame=None, capture_lock=None):
+        self.page = page
+        self.on_frame = on_frame
+        # frames painted while another capture holds this are dropped
+        self.capture_lock = capture_lock
+        self.format = format
+        self.quality = quality
+        self.max_width = max_width
+        self.max_height = max_height
+        self.fps = fps
+        self.session = None
+        self.frame = None
+        self.seq = 0
+        self.clients = {}
+        self._frame_event = asyncio.Event()
+
+    @property
+    def running(self):
+        return self.session is not None
+
+    async def start(self):
+        if self.session is not None:
+            return
+        self.session = await self.page.target.createCDPSession()
+        self.session.on('Page.screencastFrame', self._on_frame)
+        await self.session.send('Page.startScreencast', {
+            'format': self.format,
+            'quality': self.quality,
+            'maxWidth': self.max_width,
+            'maxHeight': self.max_height,
+            'everyNthFrame': 1,
+        })
+
+    async def configure(self, format=None, quality=None, max_width=None,
+                        max_height=None, fps=None):
+        """Apply new encode settings, restarting a running screencast only
+        when Chrome-side parameters actually change."""
+        self.fps = fps or self.fps
+        changed = {name: value for name, value in (
+            ('format', format), ('quality', quality),
+            ('max_width', max_width), ('max_height', max_height))
+            if value is not None and value != getattr(self, name)}
+        if not changed:
+            return
+        for name, value in changed.items():
+            setattr(self, name, value)
+        if self.session is not None:
+            await self.stop()
+            await self.start()
+
+    async def stop(self):
+        session, self.session = self.session, None
+        if session is None:
+            return
+        try:
+            await session.send('Page.stopScreencast')
+            await session.detach()
+        except Exception:
+            pass
+
+    def _on_frame(self, event):
+        if self.capture_lock is not None and self.capture_lock.locked():
+            # painted while a tile capture had the page resized
+            asyncio.ensure_future(self._ack_chrome(event['sessionId']))
+            return
+        self.seq += 1
+        metadata = event.get('metadata', {})
+        self.frame = {
+            'seq': self.seq,
+            'data': event['data'],
+            'format': self.format,
+            'width': metadata.get('deviceWidth'),
+            'height': metadata.get('deviceHeight'),
+            'timestamp': metadata.get('timestamp', time.time()),
+        }
+        asyncio.ensure_future(self._ack_chrome(event['sessionId']))
+        if self.on_frame is not None:
+            self.on_frame()
+        event, self._frame_event = self._frame_event, asyncio.Event()
+        event.set()
+
+    async def _ack_chrome(self, session_id):
+        if self.session is None:
+            return
+        try:
+            await self.session.send('Page.screencastFrameAck',
+                                    {'sessionId': session_id})
+        except Exception:
+            pass
+
+    async def add_client(self, client_id):
+        self.clients[client_id] = _Client()
+        await self.start()
+
+    async def remove_client(self, client_id):
+        self.clients.pop(client_id, None)
+        if not self.clients:
+            await self.stop()
+
+    def ack(self, client_id, seq):
+        client = self.clients.get(client_id)
+        if client is None:
+            return False
+        client.acked = max(client.acked, seq)
+        return True
+
+    def _ready(self, client):
+        if self.frame is None or self.seq <= client.sent:
+            return False
+        since_sent = time.monotonic() - client.sent_at
+        if self.fps and since_sent < 1 / self.fps:
+            return False
+        return client.acked >= client.sent or since_sent > ACK_TIMEOUT
+
+    async def next_frame(self, client_id, timeout=0.25):
+        client = self.clients.get(client_id)
+        if client is None:
+            return None
+        deadline = time.monotonic() + timeout
+        while not self._ready(client):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            # acks arrive from other threads, so poll rather than block on
+            # the frame event alone
+            try:
+                await asyncio.wait_for(self._frame_event.wait(),
+                                       min(remaining, 0.05))
+            except asyncio.TimeoutError:
+                pass
+        client.sent = self.seq
+        client.sent_at = time.monotonic()
+        return self.frame
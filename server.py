@@ -0,0 +1,27 @@
+import os
+import threading
+
+# "waitress" (default) or "flask" for the development server
+SERVER = os.environ.get('SERVER', 'waitress')
+# streams and long polls each hold a thread for their whole duration
+THREADS = int(os.environ.get('THREADS', 32))
+# threads streams and long polls may never take, so input and frame
+# requests always find one free
+RESERVED_THREADS = int(os.environ.get('RESERVED_THREADS', 8))
+# taken without blocking by every stream or long poll; one that finds none
+# left is turned away or answered at once
+long_requests = threading.BoundedSemaphore(max(1, THREADS - RESERVED_THREADS))
+# how long a long poll may still wait when every long-request slot is taken
+SHORT_POLL_TIMEOUT = 1
+# idle keep-alive connections are dropped after this many seconds
+KEEPALIVE_TIMEOUT = int(os.environ.get('KEEPALIVE_TIMEOUT', 120))
+
+
+def serve(app, port, host='0.0.0.0'):
+    """Serve ``app`` with HTTP/1.1 keep-alive on a production server."""
+    if SERVER == 'flask':
+        app.run(host=host, port=port, debug=False, threaded=True, use_reloader=False)
+        return
+    from waitress import serve as waitress_serve
+    waitress_serve(app, host=host, port=port, threads=THREADS,
+                   channel_timeout=KEEPALIVE_TIMEOUT, ident=None)
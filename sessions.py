@@ -0,0 +1,430 @@
+import asyncio
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from activity import ActivityTracker
+from broadcast import FrameBroadcaster
+from delta import DeltaEncoder
+from hibernation import capture, freeze, thaw
+from metrics import LOCK_WAIT_SECONDS
+from navigation import Navigator
+from quality import QualityController
+from resource_cache import RequestInterceptor
+from tiles import TileCache
+
+VIEWPORT = {'width': 1280, 'height': 720}
+MAINTAIN_INTERVAL = 15
+PRUNE_INTERVAL = 3600
+
+
+class Session:
+    """One client's incognito browser context and page."""
+
+    def __init__(self, session_id, context, page, cdp, viewport=VIEWPORT,
+                 activity=None, interceptor=None):
+        self.id = session_id
+        self.context = context
+        self.page = page
+        self.cdp = cdp
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+        self.last_input = self.last_used
+        # set while the page is closed and only its frozen state remains
+        self.hibernated = False
+        self.state = None
+        self._waking = None
+        # held while the session hibernates or wakes, so the two never interleave
+        self.transition = asyncio.Lock()
+        # storage last seen per origin, kept across page restores
+        self.origins = {}
+        self.saved_at = 0.0
+        self.screencaster = None
+        self.viewport = viewport
+        self.quality = QualityController(viewport)
+        self.delta = DeltaEncoder(quality=70)
+        self.activity = activity or ActivityTracker()
+        self.interceptor = interceptor
+        # a tile capture beyond the viewport briefly resizes the page, so no
+        # other capture of it may run meanwhile
+        self.capture_lock = asyncio.Lock()
+        # a session restored from a snapshot gets its page on first use
+        self.navigator = Navigator(cdp, on_paint=self._on_paint) if cdp is not None else None
+        self.broadcaster = FrameBroadcaster(page, cdp, viewport,
+                                            on_capture=self._observe,
+                                            activity=self.activity,
+                                            capture_lock=self.capture_lock)
+        self.tiles = TileCache(cdp, self.activity, capture_lock=self.capture_lock)
+
+    @contextmanager
+    def locked(self, timings=None):
+        """Hold the session lock, recording how long it took to get."""
+        started = time.perf_counter()
+        with self.lock:
+            waited = time.perf_counter() - started
+            LOCK_WAIT_SECONDS.observe(waited)
+            if timings is not None:
+                timings.stages['lock'] = waited * 1000
+            yield
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def mark_input(self):
+        self.last_input = time.monotonic()
+
+    def input_idle_for(self):
+        return time.monotonic() - self.last_input
+
+    def attach(self, context, page, cdp, activity, interceptor):
+        """Move the session onto a new page, keeping its frames."""
+        blocked = self.interceptor.blocked if self.interceptor is not None else None
+        self.context = context
+        self.page = page
+        self.cdp = cdp
+        self.activity = activity
+        self.interceptor = interceptor
+        if interceptor is not None and blocked is not None:
+            interceptor.blocked = blocked
+        self.navigator = Navigator(cdp, on_paint=self._on_paint)
+        self.broadcaster.rebind(page, cdp, activity)
+        self.tiles.rebind(cdp, activity)
+
+    def detach(self):
+        self.context = self.page = self.cdp = None
+        self.screencaster = None
+
+    def idle_for(self):
+        return time.monotonic() - self.last_used
+
+    def _on_paint(self):
+        # the new document has pixels worth showing: drop frames of the old one
+        self.broadcaster.invalidate()
+        self.activity.poke('navigation')
+
+    def _observe(self, frame):
+        format, quality, scale = frame['key']
+        if format != 'png':
+            self.quality.observe(len(frame['data']), self.viewport['width'] * scale,
+                                 self.viewport['height'] * scale, quality)
+
+
+class SessionManager:
+    """Bounded LRU pool of sessions, each in its own incognito context.
+
+    With ``hibernate_after`` set, a session that has seen no input for that
+    many seconds is hibernated: its page state and last frames are kept and
+    the context is closed. So is the least recently used live session when
+    ``max_sessions`` pages are already open. Hibernated sessions still count
+    towards ``idle_timeout``, and at most ``max_hibernated`` are kept.
+
+    With a ``SnapshotStore`` the same state is also saved to disk: for
+    sessions with recent input on every maintenance pass, and for every
+    session as it is hibernated or closed. A session id that is not in
+    memory but has a snapshot comes back as a hibernated session without
+    frames, which the first request restores.
+    """
+
+    def __init__(self, browser, max_sessions=8, idle_timeout=600,
+                 viewport=VIEWPORT, warm_pages=0, cache=None, blocked=(),
+                 hibernate_after=None, max_hibernated=256, snapshots=None):
+        self.browser = browser
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.viewport = viewport
+        self.warm_pages = warm_pages
+        self.cache = cache
+        self.blocked = set(blocked)
+        self.hibernate_after = hibernate_after
+        self.max_hibernated = max_hibernated
+        self.snapshots = snapshots
+        self.sessions = OrderedDict()
+        self._warm = []
+        self._prewarming = None
+        self._lock = threading.Lock()
+        self._open_lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def live(self):
+        with self._lock:
+            return [session for session in self.sessions.values() if not session.hibernated]
+
+    def hibernated(self):
+        with self._lock:
+            return [session for session in self.sessions.values() if session.hibernated]
+
+    def page_count(self):
+        """Open pages, counting warm spares."""
+        return len(self.live()) + len(self._warm)
+
+    def get(self, session_id):
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                self.sessions.move_to_end(session_id)
+                session.touch()
+            return session
+
+    async def acquire(self, session_id):
+        session = self.get(session_id)
+        if session is not None:
+            return session
+        async with self._open_lock:
+            session = self.get(session_id)
+            if session is not None:
+                return session
+            await self.reap()
+            await self._make_room()
+            session = await self._restore(session_id) or await self._open(session_id)
+            with self._lock:
+                self.sessions[session_id] = session
+            return session
+
+    async def _make_room(self):
+        """Get below ``max_sessions`` open pages, hibernating (or, without
+        hibernation, closing) the least recently used sessions."""
+        live = self.live()
+        while len(live) >= self.max_sessions:
+            oldest = live.pop(0)
+            if self.hibernate_after is not None:
+                await self.hibernate(oldest)
+                continue
+            with self._lock:
+                self.sessions.pop(oldest.id, None)
+            print(f"Evicting session {oldest.id}", file=sys.stderr, flush=True)
+            await self._close(oldest)
+        hibernated = self.hibernated()
+        while len(hibernated) > self.max_hibernated:
+            oldest = hibernated.pop(0)
+            with self._lock:
+                self.sessions.pop(oldest.id, None)
+            await self._close(oldest)
+
+    async def hibernate(self, session):
+        # a session that is waking holds its lock while it waits for ours
+        if session.hibernated or session._waking is not None:
+            return
+        async with session.transition:
+            if session.hibernated or session._waking is not None:
+                return
+            await self._hibernate(session)
+
+    async def _hibernate(self, session):
+        started = time.monotonic()
+        last_input = session.last_input
+        try:
+            state = await freeze(session)
+        except Exception as e:
+            # without its state the session cannot come back; drop it instead
+            print(f"Hibernate error for {session.id}: {e}", file=sys.stderr, flush=True)
+            with self._lock:
+                self.sessions.pop(session.id, None)
+            await self._close(session)
+            return
+        if session._waking is not None or session.last_input != last_input:
+            # input arrived while freezing: the page is in use again
+            return
+        # from here on nothing may reach the old page, so let go of it
+        # before the first await
+        context, screencaster = session.context, session.screencaster
+        session.state = state
+        session.broadcaster.freeze()
+        session.hibernated = True
+        session.detach()
+        await self.save(session)
+        if screencaster is not None:
+            await screencaster.stop()
+        try:
+            await context.close()
+        except Exception as e:
+            print(f"Session close error: {e}", file=sys.stderr, flush=True)
+        print(f"Hibernated session {session.id} in {(time.monotonic() - started) * 1000:.0f}ms",
+              file=sys.stderr, flush=True)
+
+    async def wake(self, session):
+        """Restore a hibernated session onto a fresh page; concurrent
+        callers share one restore."""
+        if not session.hibernated:
+            return
+        if session._waking is None:
+            session._waking = asyncio.ensure_future(self._wake(session))
+        try:
+            await asyncio.shield(session._waking)
+        finally:
+            if session._waking is not None and session._waking.done():
+                session._waking = None
+
+    async def _wake(self, session):
+        async with session.transition:
+            if session.hibernated:
+                await self._thaw(session)
+
+    async def _thaw(self, session):
+        started = time.monotonic()
+        async with self._open_lock:
+            await self._make_room()
+            warm = bool(self._warm)
+            page = self._warm.pop(0) if warm else await self._new_page()
+            self._refill()
+        previous = session.interceptor
+        session.attach(*page)
+        if previous is not None and session.interceptor is None:
+            # interception turned on for this session alone, by its blocking
+            # policy, has to come back with it
+            session.interceptor = await self.intercept(session.cdp, previous.blocked)
+        try:
+            await thaw(session, session.state)
+        except Exception as e:
+            # the page is usable even if the URL did not load again
+            print(f"Restore error for {session.id}: {e}", file=sys.stderr, flush=True)
+        session.hibernated = False
+        session.state = None
+        print(f"Restored session {session.id} in {(time.monotonic() - started) * 1000:.0f}ms "
+              f"({'warm' if warm else 'cold'})", file=sys.stderr, flush=True)
+
+    async def _restore(self, session_id):
+        if self.snapshots is None:
+            return None
+        loop = asyncio.get_event_loop()
+        try:
+            state = await loop.run_in_executor(None, self.snapshots.load, session_id)
+        except Exception as e:
+            print(f"Snapshot load error for {session_id}: {e}", file=sys.stderr, flush=True)
+            return None
+        if state is None:
+            return None
+        session = Session(session_id, None, None, None, self.viewport)
+        session.broadcaster.freeze()
+        session.hibernated = True
+        session.state = state
+        session.origins = dict(state.get('origins', {}))
+        return session
+
+    async def save(self, session):
+        """Write ``session``'s state to the snapshot store if it changed."""
+        if self.snapshots is None:
+            return
+        try:
+            state = session.state if session.hibernated else await capture(session)
+            if state is None:
+                return
+            loop = asyncio.get_event_loop()
+            if await loop.run_in_executor(None, self.snapshots.save, session.id, state):
+                print(f"Saved session {session.id}", file=sys.stderr, flush=True)
+            session.saved_at = time.monotonic()
+        except Exception as e:
+            print(f"Snapshot save error for {session.id}: {e}", file=sys.stderr, flush=True)
+
+    async def checkpoint(self, interval=MAINTAIN_INTERVAL):
+        """Save sessions that saw input since shortly before their last
+        save, so changes a navigation makes after its input are caught too."""
+        for session in self.live():
+            if session.last_input > session.saved_at - interval:
+                await self.save(session)
+
+    async def _new_page(self):
+        context = await self.browser.createIncognitoBrowserContext()
+        try:
+            page = await context.newPage()
+            await page.setViewport(self.viewport)
+            cdp = await page.target.createCDPSession()
+            activity = ActivityTracker()
+            await activity.attach(cdp)
+            interceptor = None
+            if self.cache is not None or self.blocked:
+                interceptor = await self.intercept(cdp, self.blocked)
+        except Exception:
+            await context.close()
+            raise
+        return context, page, cdp, activity, interceptor
+
+    async def intercept(self, cdp, blocked=()):
+        """Route a page's requests through the shared cache and a blocking
+        policy; None if this Chromium has no Fetch domain."""
+        interceptor = RequestInterceptor(self.cache, blocked)
+        try:
+            await interceptor.attach(cdp)
+        except Exception as e:
+            print(f"Request interception unavailable: {e}", file=sys.stderr, flush=True)
+            return None
+        return interceptor
+
+    async def prewarm(self):
+        """Keep ``warm_pages`` blank contexts ready for new sessions."""
+        while len(self._warm) < self.warm_pages:
+            self._warm.append(await self._new_page())
+
+    def _refill(self):
+        if self._prewarming is None or self._prewarming.done():
+            self._prewarming = asyncio.ensure_future(self.prewarm())
+
+    async def _open(self, session_id):
+        started = time.monotonic()
+        warm = bool(self._warm)
+        context, page, cdp, activity, interceptor = (
+            self._warm.pop(0) if warm else await self._new_page())
+        self._refill()
+        print(f"Opened session {session_id} in {(time.monotonic() - started) * 1000:.0f}ms "
+              f"({'warm' if warm else 'cold'})", file=sys.stderr, flush=True)
+        return Session(session_id, context, page, cdp, self.viewport, activity,
+                       interceptor)
+
+    async def _close(self, session):
+        await self.save(session)
+        session.broadcaster.stop()
+        if session.screencaster is not None:
+            await session.screencaster.stop()
+        if session.context is None:
+            return
+        try:
+            await session.context.close()
+        except Exception as e:
+            print(f"Session close error: {e}", file=sys.stderr, flush=True)
+
+    async def reap(self):
+        with self._lock:
+            expired = [session for session in self.sessions.values()
+                       if session.idle_for() > self.idle_timeout]
+            for session in expired:
+                del self.sessions[session.id]
+        for session in expired:
+            await self._close(session)
+        if self.hibernate_after is None:
+            return
+        for session in self.live():
+            if session.input_idle_for() > self.hibernate_after:
+                await self.hibernate(session)
+
+    async def maintain(self, interval=MAINTAIN_INTERVAL):
+        """Reap and hibernate idle sessions, save changed ones and prune
+        old snapshots in the background."""
+        pruned = None
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reap()
+                await self.checkpoint(interval)
+                if self.snapshots is not None and (
+                        pruned is None or time.monotonic() - pruned > PRUNE_INTERVAL):
+                    pruned = time.monotonic()
+                    loop = asyncio.get_event_loop()
+                    await loop.run_in_executor(None, self.snapshots.prune)
+            except Exception as e:
+                print(f"Session maintenance error: {e}", file=sys.stderr, flush=True)
+
+    async def close_all(self):
+        with self._lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            await self._close(session)
+        warm, self._warm = self._warm, []
+        for context, *_ in warm:
+            try:
+                await context.close()
+            except Exception:
+                pass
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+import time
+
+from storage import open_backend
+
+# a local path, ".json" for a JSON file and anything else SQLite; empty to
+# keep nothing across restarts. Workers behind the router share the default
+# SQLite file, so a session that fails over to another worker comes back too
+SESSION_STORE = os.environ.get('SESSION_STORE', os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '.sessions.sqlite3'))
+# snapshots not saved for this many seconds are dropped
+SNAPSHOT_MAX_AGE = int(os.environ.get('SNAPSHOT_MAX_AGE', 7 * 24 * 3600))
+SNAPSHOT_VERSION = 1
+KEY_PREFIX = 'session:'
+# what a snapshot keeps of a captured state
+FIELDS = ('url', 'scrollX', 'scrollY', 'cookies', 'origins')
+
+
+def digest(record):
+    encoded = json.dumps(record, sort_keys=True, separators=(',', ':')).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+class SnapshotStore:
+    """Persists each session's cookies, per-origin storage and URL as one
+    versioned record, rewritten only when it changed since the last save.
+
+    Blocking; call it off the browser loop."""
+
+    def __init__(self, db, max_age=SNAPSHOT_MAX_AGE):
+        self.db = db
+        self.max_age = max_age
+        self._saved = {}
+
+    @classmethod
+    def open(cls, spec=SESSION_STORE):
+        return cls(open_backend(spec)) if spec else None
+
+    def load(self, session_id):
+        """The saved state for ``session_id``, or None if there is none
+        usable."""
+        record = self.db.get(KEY_PREFIX + session_id)
+        if record is None or record.get('version') != SNAPSHOT_VERSION:
+            return None
+        if time.time() - record.get('saved', 0) > self.max_age:
+            return None
+        state = {field: record[field] for field in FIELDS if field in record}
+        self._saved[session_id] = digest(state)
+        return state
+
+    def save(self, session_id, state):
+        """Write ``state`` if it differs from what was last saved; returns
+        whether it did."""
+        state = {field: state[field] for field in FIELDS if field in state}
+        current = digest(state)
+        if self._saved.get(session_id) == current:
+            return False
+        self.db[KEY_PREFIX + session_id] = dict(state, version=SNAPSHOT_VERSION,
+                                                saved=time.time())
+        self._saved[session_id] = current
+        return True
+
+    def delete(self, session_id):
+        self._saved.pop(session_id, None)
+        try:
+            del self.db[KEY_PREFIX + session_id]
+        except KeyError:
+            pass
+
+    def prune(self):
+        """Drop snapshots older than ``max_age``; returns how many."""
+        cutoff = time.time() - self.max_age
+        stale = [key for key in self.db if key.startswith(KEY_PREFIX)
+                 and self.db[key].get('saved', 0) < cutoff]
+        for key in stale:
+            self.delete(key[len(KEY_PREFIX):])
+        return len(stale)
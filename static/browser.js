@@ -0,0 +1,530 @@
+const urlInput = document.getElementById('urlInput');
+const content = document.getElementById('content');
+const loadingIndicator = document.getElementById('loadingIndicator');
+const statusText = document.getElementById('statusText');
+const statusDot = document.getElementById('statusDot');
+const urlStatus = document.getElementById('urlStatus');
+
+let stream = null;
+let frameWidth = null;
+let canvas = null;
+let ctx = null;
+const pollClient = Math.random().toString(36).slice(2);
+let needKeyframe = true;
+// sequence number of the last delta frame applied; deltas build on each
+// other, so one arriving after a newer one is dropped
+let lastSeq = 0;
+let painting = Promise.resolve();
+
+function getCanvas(width, height) {
+    if (!canvas) {
+        canvas = document.createElement('canvas');
+        canvas.id = 'screenshot';
+        canvas.onclick = handleClick;
+        canvas.onmousemove = handleMove;
+        canvas.addEventListener('wheel', handleWheel, { passive: false });
+        ctx = canvas.getContext('2d');
+    }
+    // frames keep drawing off-screen while the page view is up
+    if (!canvas.isConnected && !pageView) {
+        content.innerHTML = '';
+        content.appendChild(canvas);
+    }
+    if (canvas.width !== width || canvas.height !== height) {
+        canvas.width = width;
+        canvas.height = height;
+    }
+    return ctx;
+}
+
+function loadImage(src) {
+    return new Promise((resolve, reject) => {
+        const img = new Image();
+        img.onload = () => resolve(img);
+        img.onerror = () => reject(new Error('Bad frame'));
+        img.src = src;
+    });
+}
+
+function showStatus(url) {
+    statusDot.classList.remove('error');
+    statusText.textContent = '✓ Connected';
+    if (url) {
+        urlStatus.textContent = url;
+        if (document.activeElement !== urlInput) urlInput.value = url;
+    }
+    loadingIndicator.textContent = 'Ready';
+}
+
+async function showFrame(src, url) {
+    const img = await loadImage(src);
+    getCanvas(img.naturalWidth, img.naturalHeight).drawImage(img, 0, 0);
+    showStatus(url);
+}
+
+async function showTiles(data) {
+    const images = await Promise.all(data.tiles.map(
+        tile => loadImage('data:image/jpeg;base64,' + tile.data)));
+    const context = getCanvas(data.width, data.height);
+    images.forEach((img, i) => context.drawImage(img, data.tiles[i].x, data.tiles[i].y));
+    showStatus(data.url);
+}
+
+// apply delta frames strictly in order: a late one is dropped and the
+// next poll asks for a keyframe instead
+function applyDelta(data) {
+    if (data.seq < lastSeq) {
+        needKeyframe = true;
+        // an older keyframe is a late reply or a session that started over;
+        // the keyframe asked for next settles which
+        if (data.keyframe) lastSeq = 0;
+        return painting;
+    }
+    lastSeq = data.seq;
+    frameWidth = data.viewport.width;
+    painting = painting.then(() => showTiles(data)).catch(() => { needKeyframe = true; });
+    return painting;
+}
+
+// one delta request at a time: callers queue behind the one in flight
+let refreshing = Promise.resolve();
+
+function refreshScreenshot(keyframe) {
+    refreshing = refreshing.then(() => fetchDelta(keyframe));
+    return refreshing;
+}
+
+async function fetchDelta(keyframe) {
+    try {
+        loadingIndicator.textContent = 'Capturing...';
+        let query = '?client=' + pollClient;
+        if (keyframe === true || needKeyframe) query += '&keyframe=1';
+        const started = performance.now();
+        const response = await fetch('/api/screenshot/delta' + query);
+        if (!response.ok) throw new Error('Capture failed');
+
+        const body = await response.text();
+        recordTransfer(body.length, performance.now() - started);
+        const data = JSON.parse(body);
+        if (data.keyframe) needKeyframe = false;
+        await applyDelta(data);
+
+    } catch (e) {
+        needKeyframe = true;
+        statusDot.classList.add('error');
+        statusText.textContent = '✗ Error: ' + e.message;
+        loadingIndicator.textContent = 'Error';
+        if (!pageView) content.innerHTML = `<div class="loading" style="color: #f00;">Error: ${e.message}</div>`;
+    }
+}
+
+let polling = false;
+let pollRun = 0;
+let pollTimer = null;
+let pollInterval = 1000;
+
+// each poll is scheduled once the previous one has finished, so they
+// never overlap however short the interval
+function startPolling() {
+    if (polling) return;
+    polling = true;
+    needKeyframe = true;
+    poll(++pollRun);
+}
+
+async function poll(run) {
+    await refreshScreenshot();
+    if (polling && run === pollRun) pollTimer = setTimeout(poll, pollInterval, run);
+}
+
+function stopPolling() {
+    polling = false;
+    pollRun++;
+    clearTimeout(pollTimer);
+    pollTimer = null;
+}
+
+// throughput in bytes/s and round-trip time in ms, smoothed
+const net = { throughput: null, rtt: null };
+const supportsWebp = document.createElement('canvas')
+    .toDataURL('image/webp').startsWith('data:image/webp');
+
+function recordTransfer(bytes, ms) {
+    if (ms <= 0) return;
+    // small responses measure latency, not bandwidth
+    if (bytes > 20000) {
+        const rate = bytes / (ms / 1000);
+        net.throughput = net.throughput ? 0.7 * net.throughput + 0.3 * rate : rate;
+    } else {
+        net.rtt = net.rtt ? 0.7 * net.rtt + 0.3 * ms : ms;
+    }
+}
+
+async function reportClient() {
+    const container = content.parentElement;
+    let throughput = net.throughput;
+    if (navigator.connection && navigator.connection.downlink) {
+        const downlink = navigator.connection.downlink * 125000;
+        throughput = throughput ? Math.min(throughput, downlink) : downlink;
+    }
+    try {
+        const response = await fetch('/api/client-info', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                width: container.clientWidth,
+                height: container.clientHeight,
+                dpr: window.devicePixelRatio || 1,
+                throughput,
+                rtt: net.rtt,
+                webp: supportsWebp
+            })
+        });
+        if (!response.ok) return;
+        const settings = await response.json();
+        const interval = Math.min(2000, Math.max(200, 1000 / settings.fps));
+        // the next poll picks it up
+        if (Math.abs(interval - pollInterval) > 50) pollInterval = interval;
+    } catch (e) {
+        console.error('Client report failed:', e);
+    }
+}
+
+function startStream() {
+    if (!window.EventSource) return startPolling();
+    let clientId = null;
+    stream = new EventSource('/api/stream');
+    stream.addEventListener('hello', (e) => {
+        clientId = JSON.parse(e.data).client;
+        if (polling) {
+            stopPolling();
+            needKeyframe = true;
+        }
+    });
+    stream.addEventListener('frame', (e) => {
+        const frame = JSON.parse(e.data);
+        frameWidth = frame.width;
+        showFrame(`data:image/${frame.format};base64,${frame.data}`, frame.url)
+            .catch(() => {});
+        const started = performance.now();
+        fetch('/api/stream/ack', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ client: clientId, seq: frame.seq })
+        }).then(() => recordTransfer(0, performance.now() - started))
+          .catch(() => {});
+    });
+    stream.onerror = () => {
+        // EventSource reconnects by itself; poll in the meantime
+        if (stream.readyState === EventSource.CLOSED) stream = null;
+        startPolling();
+    };
+}
+
+// Page view: the whole document as tiles, scrolled locally. Tiles are
+// fetched as they come into view. A tile whose X-Doc-Version is newer than
+// the layout's means the document changed: the layout is refetched (at most
+// once a second) and tiles of older versions stay on screen until they are
+// revalidated by ETag, so only the tiles that really changed are reloaded.
+const REFRESH_DELAY = 1000;
+let pageView = null;
+
+async function togglePageView() {
+    if (pageView) return closePageView();
+    try {
+        loadingIndicator.textContent = 'Loading page view...';
+        openPageView(await fetchLayout());
+        loadingIndicator.textContent = 'Page view';
+    } catch (e) {
+        loadingIndicator.textContent = e.message;
+    }
+}
+
+async function fetchLayout() {
+    const response = await fetch('/api/tiles');
+    if (!response.ok) throw new Error('Page view failed');
+    return response.json();
+}
+
+function openPageView(layout) {
+    const view = document.createElement('div');
+    view.id = 'pageView';
+    const sheet = document.createElement('div');
+    sheet.className = 'page-sheet';
+    view.appendChild(sheet);
+    content.innerHTML = '';
+    content.appendChild(view);
+    pageView = { layout, view, sheet, tiles: new Map(), loading: new Set(), refresh: null };
+    layoutPageView();
+    view.scrollTop = layout.scroll.y * pageScale();
+    view.addEventListener('scroll', loadVisibleTiles, { passive: true });
+    view.onclick = leavePageViewAt;
+    loadVisibleTiles();
+}
+
+function closePageView() {
+    if (!pageView) return;
+    clearTimeout(pageView.refresh);
+    dropTiles(0);
+    pageView = null;
+    content.innerHTML = '';
+    if (canvas) content.appendChild(canvas);
+    if (!stream) refreshScreenshot();
+}
+
+function pageScale() {
+    return pageView.view.clientWidth / pageView.layout.width;
+}
+
+function layoutPageView() {
+    const { layout, sheet, tiles } = pageView;
+    const scale = pageScale();
+    sheet.style.height = layout.height * scale + 'px';
+    tiles.forEach((tile, index) => {
+        tile.img.style.top = index * layout.tile_height * scale + 'px';
+    });
+}
+
+// drops tiles from ``first`` on
+function dropTiles(first) {
+    pageView.tiles.forEach((tile, index) => {
+        if (index < first) return;
+        URL.revokeObjectURL(tile.img.src);
+        tile.img.remove();
+        pageView.tiles.delete(index);
+    });
+}
+
+function loadVisibleTiles() {
+    const { layout, view, tiles } = pageView;
+    const scale = pageScale();
+    // one tile of look-ahead each way
+    const first = Math.max(0, Math.floor(view.scrollTop / scale / layout.tile_height) - 1);
+    const last = Math.min(layout.count - 1,
+        Math.floor((view.scrollTop + view.clientHeight) / scale / layout.tile_height) + 1);
+    for (let index = first; index <= last; index++) {
+        const tile = tiles.get(index);
+        if (!tile || tile.version !== layout.version) loadTile(index);
+    }
+}
+
+async function loadTile(index) {
+    const state = pageView;
+    if (state.loading.has(index)) return;
+    state.loading.add(index);
+    const cached = state.tiles.get(index);
+    try {
+        const started = performance.now();
+        const response = await fetch('/api/tiles/' + index, {
+            headers: cached ? { 'If-None-Match': `"${cached.etag}"` } : {}
+        });
+        if (response.status !== 304 && !response.ok) throw new Error('Tile failed');
+        const etag = (response.headers.get('ETag') || '').replace(/"/g, '');
+        const version = response.headers.get('X-Doc-Version');
+        const blob = response.status === 304 ? null : await response.blob();
+        recordTransfer(blob ? blob.size : 0, performance.now() - started);
+        if (state !== pageView) return;
+        if (cached && (!blob || etag === cached.etag)) {
+            // unchanged by whatever bumped the version
+            cached.version = version;
+        } else if (blob) {
+            const img = cached ? cached.img : new Image();
+            if (cached) URL.revokeObjectURL(img.src);
+            img.src = URL.createObjectURL(blob);
+            img.style.top = index * state.layout.tile_height * pageScale() + 'px';
+            if (!cached) state.sheet.appendChild(img);
+            state.tiles.set(index, { img, etag, version });
+        }
+        if (version !== state.layout.version) scheduleRefresh();
+    } catch (e) {
+        console.error('Tile failed:', e);
+    } finally {
+        state.loading.delete(index);
+    }
+}
+
+function scheduleRefresh() {
+    const state = pageView;
+    if (state.refresh) return;
+    state.refresh = setTimeout(async () => {
+        try {
+            const layout = await fetchLayout();
+            if (state !== pageView) return;
+            state.layout = layout;
+            dropTiles(layout.count);
+            layoutPageView();
+            loadVisibleTiles();
+        } catch (e) {
+            console.error('Page view refresh failed:', e);
+        } finally {
+            state.refresh = null;
+        }
+    }, REFRESH_DELAY);
+}
+
+function leavePageViewAt(e) {
+    // scroll the real page to what is on screen here, then go back to it
+    const { layout, view } = pageView;
+    const top = Math.round(view.scrollTop / pageScale());
+    queueInput({ type: 'wheel', x: 1, y: 1, dx: 0, dy: top - layout.scroll.y });
+    closePageView();
+}
+
+window.addEventListener('resize', () => {
+    if (!pageView) return;
+    layoutPageView();
+    loadVisibleTiles();
+});
+
+const PAINTED = ['firstpaint', 'firstcontentfulpaint', 'load', 'complete'];
+
+async function navigateTo() {
+    const url = urlInput.value || 'https://google.com';
+    closePageView();
+    try {
+        loadingIndicator.textContent = 'Navigating...';
+        const response = await fetch('/api/navigate', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ url })
+        });
+        if (!response.ok) throw new Error('Navigation failed');
+        await followNavigation(await response.json());
+    } catch (e) {
+        statusDot.classList.add('error');
+        statusText.textContent = '✗ ' + e.message;
+        loadingIndicator.textContent = 'Failed';
+    }
+}
+
+async function followNavigation(job) {
+    let seq = 0;
+    let painted = false;
+    while (true) {
+        const response = await fetch('/api/navigate/' + job.job + '?after=' + seq);
+        if (!response.ok) throw new Error('Navigation failed');
+        const data = await response.json();
+        seq = data.seq;
+        const names = data.events.map(event => event.name);
+        if (names.length) loadingIndicator.textContent = 'Loading: ' + names[names.length - 1];
+        if (data.state === 'failed') throw new Error(data.error || 'Navigation failed');
+        if (!painted && names.some(name => PAINTED.includes(name))) {
+            painted = true;
+            if (!stream) await refreshScreenshot(true);
+        }
+        if (data.done) {
+            if (!stream) await refreshScreenshot();
+            loadingIndicator.textContent = data.state === 'complete' ? 'Ready' : data.state;
+            return;
+        }
+    }
+}
+
+let inputQueue = [];
+let inputInFlight = false;
+
+function toPage(e) {
+    const rect = e.target.getBoundingClientRect();
+    const scale = (frameWidth || e.target.width) / rect.width;
+    return {
+        x: Math.round((e.clientX - rect.left) * scale),
+        y: Math.round((e.clientY - rect.top) * scale),
+        alt: e.altKey, ctrl: e.ctrlKey, meta: e.metaKey, shift: e.shiftKey
+    };
+}
+
+function queueInput(event) {
+    inputQueue.push(event);
+    if (!inputInFlight) flushInput();
+}
+
+async function flushInput() {
+    if (!inputQueue.length) return;
+    const events = inputQueue;
+    inputQueue = [];
+    inputInFlight = true;
+    const wantFrame = polling || !stream;
+    try {
+        const response = await fetch('/api/input', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ events, client: pollClient, frame: wantFrame ? 'delta' : 'none' })
+        });
+        if (!response.ok) throw new Error('Input failed');
+        // the input woke the session if it was hibernated; a stream that
+        // gave up meanwhile can come back
+        if (!stream) startStream();
+        const data = await response.json();
+        if (data.frame) await applyDelta(data.frame);
+    } catch (e) {
+        console.error('Input failed:', e);
+    } finally {
+        inputInFlight = false;
+        // events that arrived meanwhile go out as one batch
+        if (inputQueue.length) flushInput();
+    }
+}
+
+function handleClick(e) {
+    queueInput(Object.assign({ type: 'click' }, toPage(e)));
+}
+
+function handleMove(e) {
+    // moves are coalesced server-side; only send one per batch here
+    if (inputQueue.length && inputQueue[inputQueue.length - 1].type === 'move') inputQueue.pop();
+    queueInput(Object.assign({ type: 'move' }, toPage(e)));
+}
+
+function handleWheel(e) {
+    e.preventDefault();
+    const scale = e.deltaMode === 1 ? 40 : e.deltaMode === 2 ? 800 : 1;
+    queueInput(Object.assign({ type: 'wheel', dx: e.deltaX * scale, dy: e.deltaY * scale }, toPage(e)));
+}
+
+function keyEvent(type, e) {
+    return { type, key: e.key, code: e.code,
+             alt: e.altKey, ctrl: e.ctrlKey, meta: e.metaKey, shift: e.shiftKey };
+}
+
+function forPage(e) {
+    // keys an IME is composing arrive as text once it is done
+    return e.target !== urlInput && canvas && canvas.isConnected
+        && !e.isComposing && e.key !== 'Process' && e.key !== 'Dead';
+}
+
+function isPaste(e) {
+    return (e.ctrlKey || e.metaKey) && e.key.toLowerCase() === 'v';
+}
+
+document.addEventListener('keydown', (e) => {
+    if (e.target === urlInput) {
+        if (e.key === 'Enter') navigateTo();
+        return;
+    }
+    if (!forPage(e)) return;
+    // let the browser fire a paste event with the local clipboard
+    if (isPaste(e)) return;
+    e.preventDefault();
+    queueInput(keyEvent('keydown', e));
+});
+
+document.addEventListener('keyup', (e) => {
+    if (!forPage(e) || isPaste(e)) return;
+    queueInput(keyEvent('keyup', e));
+});
+
+document.addEventListener('paste', (e) => {
+    if (e.target === urlInput || !canvas || !canvas.isConnected) return;
+    e.preventDefault();
+    queueInput({ type: 'text', text: e.clipboardData.getData('text') });
+});
+
+document.addEventListener('compositionend', (e) => {
+    if (e.target === urlInput || !canvas || !canvas.isConnected) return;
+    if (e.data) queueInput({ type: 'text', text: e.data });
+});
+
+startStream();
+reportClient();
+setInterval(reportClient, 5000);
+window.addEventListener('resize', reportClient);
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+
+class FileBackend(MutableMapping):
+    """A JSON file that behaves like the Replit ``db`` for local runs."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as file:
+                self._data = json.load(file)
+        except FileNotFoundError:
+            self._data = {}
+
+    def _flush(self) -> None:
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(self._data, file, separators=(",", ":"))
+        os.replace(temporary, self.path)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._flush()
+
+    def __delitem__(self, key) -> None:
+        with self._lock:
+            del self._data[key]
+            self._flush()
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SqliteBackend(MutableMapping):
+    """A single-table SQLite key-value store with the Replit ``db`` API."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS kv "
+                               "(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def __getitem__(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM kv WHERE key = ?",
+                                     (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __setitem__(self, key, value) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO kv VALUES (?, ?)",
+                               (key, json.dumps(value, separators=(",", ":"))))
+
+    def __delitem__(self, key) -> None:
+        with self._lock, self._conn:
+            if not self._conn.execute("DELETE FROM kv WHERE key = ?",
+                                      (key,)).rowcount:
+                raise KeyError(key)
+
+    def __iter__(self):
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute("SELECT key FROM kv")]
+        return iter(keys)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+
+
+def open_backend(spec: str) -> MutableMapping:
+    """``"replit"`` for the Replit database, otherwise a local path; paths
+    ending in ``.json`` use a JSON file and anything else SQLite."""
+    if spec == "replit":
+        from replit import db
+        return db
+    if spec.endswith(".json"):
+        return FileBackend(spec)
+    return SqliteBackend(spec)
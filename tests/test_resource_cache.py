@@ -0,0 +1,229 @@
+"""Resource cache tests that need no browser: ``freshness``, ``DiskCache``
+and a ``RequestInterceptor`` driven by a fake CDP session that fetches
+assets from a local fixture server.
+
+    python -m pytest tests
+"""
+import asyncio
+import base64
+import http.server
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from resource_cache import DiskCache, RequestInterceptor, freshness
+
+ASSETS = {
+    'app.js': ('Script', b'console.log("app");\n' * 64),
+    'style.css': ('Stylesheet', b'body { margin: 0; }\n' * 64),
+    'logo.png': ('Image', bytes(range(256)) * 8),
+}
+
+
+class FixtureHandler(http.server.SimpleHTTPRequestHandler):
+    def end_headers(self):
+        self.send_header('Cache-Control', 'public, max-age=3600')
+        super().end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeCDP:
+    """Just enough of a CDP session for ``RequestInterceptor``: paused
+    requests that are continued are fetched for real and paused again at the
+    response stage, as Chromium does."""
+
+    def __init__(self):
+        self.handlers = {}
+        self.fulfilled = []
+        self.failed = []
+        self.bodies = {}
+
+    def on(self, event, handler):
+        self.handlers[event] = handler
+
+    def pause(self, event):
+        self.handlers['Fetch.requestPaused'](event)
+
+    async def send(self, method, params=None):
+        if method == 'Fetch.continueRequest':
+            event = self.paused.pop(params['requestId'], None)
+            if event is not None and 'responseStatusCode' not in event:
+                asyncio.ensure_future(self._respond(event))
+        elif method == 'Fetch.fulfillRequest':
+            self.fulfilled.append(params['requestId'])
+        elif method == 'Fetch.failRequest':
+            self.failed.append(params['requestId'])
+        elif method == 'Fetch.getResponseBody':
+            return {'body': base64.b64encode(self.bodies[params['requestId']]).decode(),
+                    'base64Encoded': True}
+        return {}
+
+    async def _respond(self, event):
+        loop = asyncio.get_event_loop()
+        response = await loop.run_in_executor(
+            None, urllib.request.urlopen, event['request']['url'])
+        with response:
+            self.bodies[event['requestId']] = response.read()
+            headers = [{'name': name, 'value': value} for name, value in response.getheaders()]
+        self.pause(dict(event, responseStatusCode=response.status,
+                        responseHeaders=headers))
+
+    async def load(self, urls):
+        """Request every URL as one page load would, and wait for the
+        interceptor to finish with them."""
+        self.paused = {}
+        for number, (url, resource_type) in enumerate(urls):
+            request_id = f'{url}#{number}'
+            event = {'requestId': request_id, 'resourceType': resource_type,
+                     'request': {'url': url, 'method': 'GET'}}
+            self.paused[request_id] = event
+            self.pause(event)
+        while True:
+            await asyncio.sleep(0.05)
+            pending = [task for task in asyncio.all_tasks()
+                       if task is not asyncio.current_task()]
+            if not pending:
+                return
+
+
+class FreshnessTest(unittest.TestCase):
+    def test_max_age(self):
+        self.assertEqual(freshness({'cache-control': 'max-age=60'}, now=100), 160)
+        self.assertEqual(freshness({'cache-control': 'max-age=60, s-maxage=10'}, now=100), 110)
+
+    def test_not_storable(self):
+        for headers in ({'cache-control': 'no-store'}, {'cache-control': 'private, max-age=60'},
+                        {'cache-control': 'max-age=0'}, {'cache-control': 'max-age=60',
+                                                          'vary': 'Cookie'}, {}):
+            self.assertIsNone(freshness(headers, now=100), headers)
+
+    def test_expires(self):
+        self.assertEqual(freshness({'expires': 'Thu, 01 Jan 2099 00:00:00 GMT'}, now=100),
+                         4070908800)
+        self.assertIsNone(freshness({'expires': 'Thu, 01 Jan 1970 00:00:00 GMT'}, now=100))
+        self.assertIsNone(freshness({'expires': 'soon'}, now=100))
+
+
+class DiskCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_hits_and_expiry(self):
+        cache = DiskCache(self.directory)
+        self.assertIsNone(cache.get('http://a/x.js'))
+        cache.put('http://a/x.js', 200, {'content-type': 'text/javascript'}, b'x', time.time() + 60)
+        cache.put('http://a/old.js', 200, {}, b'old', time.time() - 1)
+        self.assertEqual(cache.get('http://a/x.js'), (200, {'content-type': 'text/javascript'}, b'x'))
+        self.assertIsNone(cache.get('http://a/old.js'))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+
+    def test_identical_bodies_stored_once(self):
+        cache = DiskCache(self.directory)
+        expires = time.time() + 60
+        cache.put('http://a/1.js', 200, {}, b'same', expires)
+        cache.put('http://b/2.js', 200, {}, b'same', expires)
+        objects = [name for _, _, names in os.walk(os.path.join(self.directory, 'objects'))
+                   for name in names]
+        self.assertEqual(len(objects), 1)
+        self.assertEqual(cache.stats()['entries'], 2)
+
+    def test_lru_eviction(self):
+        cache = DiskCache(self.directory, max_bytes=250)
+        expires = time.time() + 60
+        for name in 'abc':
+            cache.put(f'http://a/{name}', 200, {}, name.encode() * 100, expires)
+            time.sleep(0.01)
+        # a and b fit; c pushed out a, the least recently used
+        self.assertIsNone(cache.get('http://a/a'))
+        self.assertIsNotNone(cache.get('http://a/b'))
+        time.sleep(0.01)
+        cache.put('http://a/d', 200, {}, b'd' * 100, expires)
+        # b was just used, so c goes
+        self.assertIsNotNone(cache.get('http://a/b'))
+        self.assertIsNone(cache.get('http://a/c'))
+        self.assertLessEqual(cache.stats()['bytes'], 250)
+
+
+class InterceptorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.site = tempfile.mkdtemp()
+        for name, (_, body) in ASSETS.items():
+            with open(os.path.join(cls.site, name), 'wb') as file:
+                file.write(body)
+        handler = lambda *args, **kwargs: FixtureHandler(*args, directory=cls.site, **kwargs)
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f'http://127.0.0.1:{cls.server.server_address[1]}/'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.site)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def load_twice(self, cache, blocked=()):
+        urls = [(self.base + name, resource_type)
+                for name, (resource_type, _) in ASSETS.items()]
+
+        async def main():
+            interceptor = RequestInterceptor(cache, blocked)
+            first, second = FakeCDP(), FakeCDP()
+            await interceptor.attach(first)
+            await first.load(urls)
+            after_first = dict(interceptor.counts)
+            # the second load is a fresh page sharing the cache
+            await interceptor.attach(second)
+            await second.load(urls)
+            return after_first, interceptor, first, second
+
+        return asyncio.run(main())
+
+    def test_second_load_served_from_cache(self):
+        cache = DiskCache(self.directory)
+        after_first, interceptor, first, second = self.load_twice(cache)
+        self.assertEqual(after_first,
+                         {'blocked': 0, 'hits': 0, 'misses': 3, 'stored': 3})
+        self.assertEqual(interceptor.counts,
+                         {'blocked': 0, 'hits': 3, 'misses': 3, 'stored': 3})
+        self.assertEqual(first.fulfilled, [])
+        self.assertEqual(len(second.fulfilled), 3)
+        self.assertEqual(cache.stats()['entries'], 3)
+        for url, _, body in ((self.base + name, *asset) for name, asset in ASSETS.items()):
+            self.assertEqual(cache.get(url)[2], body)
+
+    def test_eviction_keeps_cache_bounded(self):
+        # room for two of the three assets
+        sizes = sorted(len(body) for _, body in ASSETS.values())
+        cache = DiskCache(self.directory, max_bytes=sizes[-1] + sizes[-2])
+        after_first, interceptor, _, _ = self.load_twice(cache)
+        self.assertEqual(after_first['stored'], 3)
+        self.assertLessEqual(cache.stats()['bytes'], sizes[-1] + sizes[-2])
+        self.assertLess(cache.stats()['entries'], 3)
+        self.assertLess(interceptor.counts['hits'], 3)
+
+    def test_blocked_classes(self):
+        _, interceptor, first, second = self.load_twice(DiskCache(self.directory), {'images'})
+        self.assertEqual(len(first.failed), 1)
+        self.assertEqual(len(second.failed), 1)
+        self.assertEqual(interceptor.counts['blocked'], 2)
+        self.assertEqual(interceptor.counts['hits'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
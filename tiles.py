@@ -0,0 +1,129 @@
+import asyncio
+import math
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+from frames import capture_region, frame_etag
+from metrics import CAPTURE_SECONDS, TILE_REQUESTS
+
+# CSS pixels per tile; tall enough that a screenful needs one or two
+TILE_HEIGHT = int(os.environ.get('TILE_HEIGHT', 1024))
+# tiles kept per session, across documents and encodings
+MAX_TILES = int(os.environ.get('MAX_TILES', 48))
+# the document version moves at most this often, so pages that never stop
+# mutating (clocks, carousels, ads) do not have their tiles recaptured
+# at the rate they change
+VERSION_INTERVAL = 2.0
+
+
+class TileCache:
+    """A session's whole document as full-width tiles of ``tile_height``
+    CSS pixels, captured lazily with ``clip`` and ``captureBeyondViewport``.
+
+    Tiles are cached by document version and index, plus their encoding.
+    The version changes when the ``ActivityTracker`` has seen something that
+    can change the document (a DOM mutation, navigation or input), at most
+    every ``VERSION_INTERVAL`` seconds, and every time the cache moves to a
+    new page. A client holding tiles of an older version revalidates them
+    by ETag, one at a time. Captures hold ``capture_lock`` because a
+    capture beyond the viewport briefly resizes the page; share it with
+    whatever else captures the same page. Runs on the browser loop.
+    """
+
+    def __init__(self, cdp, activity, tile_height=TILE_HEIGHT, max_tiles=MAX_TILES,
+                 capture_lock=None):
+        self.tile_height = tile_height
+        self.max_tiles = max_tiles
+        self.tiles = OrderedDict()
+        self._layout = None
+        self._inflight = {}
+        self.capture_lock = capture_lock or asyncio.Lock()
+        self.rebind(cdp, activity)
+
+    def rebind(self, cdp, activity):
+        self.cdp = cdp
+        self.activity = activity
+        # versions of different pages must never compare equal
+        self.epoch = uuid.uuid4().hex[:8]
+        self._revision = 0
+        self._seen = activity.version
+        self._changed_at = 0.0
+        self.tiles.clear()
+        self._layout = None
+
+    @property
+    def version(self):
+        now = time.monotonic()
+        if self.activity.version != self._seen and now - self._changed_at >= VERSION_INTERVAL:
+            self._seen = self.activity.version
+            self._changed_at = now
+            self._revision += 1
+        return f'{self.epoch}.{self._revision}'
+
+    async def layout(self):
+        """Size of the document, how it splits into tiles, and where the
+        viewport is scrolled to, for the current version."""
+        version = self.version
+        if self._layout is not None and self._layout['version'] == version:
+            return dict(self._layout, scroll=await self._scroll())
+        metrics = await self.cdp.send('Page.getLayoutMetrics')
+        size = metrics.get('cssContentSize') or metrics['contentSize']
+        width, height = math.ceil(size['width']), math.ceil(size['height'])
+        self._layout = {
+            'version': version,
+            'width': width,
+            'height': height,
+            'tile_height': self.tile_height,
+            'count': max(1, math.ceil(height / self.tile_height)),
+        }
+        return dict(self._layout, scroll=self._viewport_scroll(metrics))
+
+    async def _scroll(self):
+        return self._viewport_scroll(await self.cdp.send('Page.getLayoutMetrics'))
+
+    @staticmethod
+    def _viewport_scroll(metrics):
+        viewport = metrics.get('cssLayoutViewport') or metrics['layoutViewport']
+        return {'x': viewport['pageX'], 'y': viewport['pageY']}
+
+    async def tile(self, index, format='jpeg', quality=70, scale=1.0):
+        """Return ``{'data', 'etag', 'version', 'y', 'height'}`` for tile
+        ``index`` of the current document."""
+        layout = await self.layout()
+        if not 0 <= index < layout['count']:
+            raise IndexError(f'No tile {index}')
+        key = (layout['version'], index, format, quality, scale)
+        tile = self.tiles.get(key)
+        if tile is not None:
+            TILE_REQUESTS.inc(result='hit')
+            self.tiles.move_to_end(key)
+            return tile
+        TILE_REQUESTS.inc(result='miss')
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            inflight = self._inflight[key] = asyncio.ensure_future(
+                self._capture(key, layout))
+            inflight.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(inflight)
+
+    async def _capture(self, key, layout):
+        version, index, format, quality, scale = key
+        y = index * self.tile_height
+        height = min(self.tile_height, layout['height'] - y)
+        async with self.capture_lock:
+            started = time.perf_counter()
+            data = await capture_region(self.cdp, 0, y, layout['width'], height,
+                                        format, quality, scale)
+            CAPTURE_SECONDS.observe(time.perf_counter() - started, format=f'tile-{format}')
+        tile = {'data': data, 'etag': frame_etag(data), 'version': version,
+                'y': y, 'height': height}
+        # tiles of older versions are never asked for again
+        for stale in [cached for cached in self.tiles if cached[0] != self.version]:
+            del self.tiles[stale]
+        if version == self.version:
+            self.tiles[key] = tile
+            while len(self.tiles) > self.max_tiles:
+                self.tiles.popitem(last=False)
+        return tile